@@ -1,8 +1,16 @@
+import { randomBytes } from "node:crypto";
+
+// Cabecera W3C traceparent para correlacionar con las trazas de rag_api.
+// Sin flag de muestreo: la API decide (RAG_TRACE_SAMPLE_RATE).
+const newTraceparent = (): string =>
+  `00-${randomBytes(16).toString("hex")}-${randomBytes(8).toString("hex")}-00`;
+
 export const getContextFromQuery = async (
   prompt: string,
   language: string = "en",
   onToken?: (token: string) => void,
-  externalAbortController?: AbortController
+  externalAbortController?: AbortController,
+  traceparent: string = newTraceparent()
 ): Promise<string> => {
   const controller = new AbortController();
   const timeoutId = setTimeout(() => {
@@ -20,10 +28,11 @@ export const getContextFromQuery = async (
     console.log("=== Starting RAG API context fetch ===");
     console.log(`Prompt length: ${prompt.length}`);
     console.log(`Language: ${language}`);
+    console.log(`Traceparent: ${traceparent}`);
 
     const response = await fetch("http://localhost:8000/context", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", traceparent },
       body: JSON.stringify({ prompt, lang: language }),
       signal: controller?.signal,
     });
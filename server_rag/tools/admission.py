@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+
+# Clases de prioridad de /context: menor número, antes sale de la cola
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class AdmissionRejected(Exception):
+    """Petición no admitida: status_code 429 (cola llena) o 503 (plazo vencido)."""
+
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Limita las generaciones en vuelo y ordena las que esperan.
+
+    Hasta ``max_in_flight`` generaciones a la vez; el resto espera en una
+    cola acotada a ``max_queue``, por prioridad y en orden de llegada, como
+    mucho ``queue_timeout`` segundos. Si la cola está llena se rechaza al
+    momento (429) y si vence el plazo se devuelve 503, los dos con un
+    Retry-After estimado con la duración media de una generación. Las
+    peticiones batch solo pueden ocupar ``batch_queue_share`` de la cola,
+    para dejar sitio a las interactivas.
+    """
+
+    def __init__(
+        self, max_in_flight, max_queue=32, queue_timeout=15.0, batch_queue_share=0.5
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.batch_queue_share = batch_queue_share
+        self.in_flight = 0
+        self.queued = {name: 0 for name in PRIORITIES}
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._waiters = []  # heap de (prioridad, orden, clase, future)
+        self._order = itertools.count()
+        self._waits = deque(maxlen=1024)
+        self._hold_time = 10.0  # media móvil de la duración de un hueco
+
+    def retry_after(self):
+        waiting = sum(self.queued.values()) + 1
+        return max(1, math.ceil(self._hold_time * waiting / self.max_in_flight))
+
+    def _queue_limit(self, priority):
+        if priority == "batch":
+            return int(self.max_queue * self.batch_queue_share)
+        return self.max_queue
+
+    async def acquire(self, priority="interactive"):
+        """Espera un hueco de generación. Hay que llamar a release() al acabar."""
+        started = time.monotonic()
+        if self.in_flight < self.max_in_flight and not any(self.queued.values()):
+            self.in_flight += 1
+            self.admitted += 1
+            self._waits.append(0.0)
+            return
+
+        if sum(self.queued.values()) >= self._queue_limit(priority):
+            self.rejected_full += 1
+            raise AdmissionRejected(429, self.retry_after(), "Too many pending requests")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters, (PRIORITIES[priority], next(self._order), priority, future)
+        )
+        self.queued[priority] += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.queued[priority] -= 1
+                self.rejected_timeout += 1
+                raise AdmissionRejected(503, self.retry_after(), "Queue wait deadline exceeded")
+        except asyncio.CancelledError:
+            # El hueco pudo llegar justo al cancelar: se devuelve
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+                self.queued[priority] -= 1
+            raise
+        self._waits.append(time.monotonic() - started)
+
+    def release(self, held=None):
+        """Libera un hueco y se lo pasa al primero de la cola."""
+        if held is not None:
+            self._hold_time = 0.9 * self._hold_time + 0.1 * held
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters and self.in_flight < self.max_in_flight:
+            _, _, priority, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # Venció su plazo o se canceló
+            self.queued[priority] -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            future.set_result(None)
+
+    def stats(self):
+        waits = sorted(self._waits) or [0.0]
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": dict(self.queued),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1),
+            "wait_ms_p95": round(waits[int(len(waits) * 0.95)] * 1000, 1),
+            "avg_generation_s": round(self._hold_time, 2),
+        }
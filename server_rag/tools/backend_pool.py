@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import httpx
+import ollama
+
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Errores tras los que se prueba otro host
+BACKEND_ERRORS = (ollama.ResponseError, httpx.HTTPError, OSError)
+
+
+class OllamaBackend:
+    """Un servidor Ollama del pool y su carga actual."""
+
+    def __init__(self, host, max_streams):
+        self.host = host
+        self.client = ollama.AsyncClient(host=host)
+        self.max_streams = max_streams
+        self.in_flight = 0
+        self.healthy = True
+        self.served = 0
+        self.failures = 0
+        self.last_error = None
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "max_streams": self.max_streams,
+            "served": self.served,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    """Reparte las generaciones entre varios hosts de Ollama.
+
+    Cada generación va al host sano con menos streams en vuelo (relativo a
+    su máximo); si todos están llenos se espera a que uno quede libre. Si un
+    host falla antes de dar el primer chunk se marca como caído y se prueba
+    el siguiente; ``watch`` lo vuelve a dar por sano cuando responde. Un
+    fallo a mitad de stream no se reintenta: parte de la respuesta ya se
+    envió al cliente.
+    """
+
+    def __init__(self, hosts, max_streams_per_host=4, health_timeout=2.0):
+        self.backends = [OllamaBackend(host, max_streams_per_host) for host in hosts]
+        self.health_timeout = health_timeout
+        self.failovers = 0
+        self._slots = asyncio.Condition()
+
+    def mark_failed(self, backend, error):
+        backend.healthy = False
+        backend.failures += 1
+        backend.last_error = str(error) or type(error).__name__
+        ERRORS.labels(stage="backend").inc()
+        logger.error("❌ Ollama backend failed host=%s error=%s", backend.host, backend.last_error)
+
+    async def _acquire(self, tried):
+        """Host sin probar con hueco y menos carga; None si ya se probaron todos."""
+        async with self._slots:
+            while True:
+                remaining = [b for b in self.backends if b not in tried]
+                if not remaining:
+                    return None
+                # Los hosts caídos solo se prueban si no queda ninguno sano
+                healthy = [b for b in remaining if b.healthy]
+                free = [b for b in healthy or remaining if b.in_flight < b.max_streams]
+                if free:
+                    backend = min(free, key=lambda b: b.in_flight / b.max_streams)
+                    backend.in_flight += 1
+                    return backend
+                await self._slots.wait()
+
+    async def _release(self, backend):
+        async with self._slots:
+            backend.in_flight -= 1
+            # A todos: el primero puede haber probado ya este host y otro no
+            self._slots.notify_all()
+
+    @asynccontextmanager
+    async def generate(self, **kwargs):
+        """Stream de ``AsyncClient.generate(stream=True)`` en el mejor host.
+
+        Uso: ``async with pool.generate(model=..., prompt=...) as stream``.
+        Al salir se cierra el stream HTTP (Ollama deja de generar) y se
+        libera el hueco del host.
+        """
+        tried = set()
+        error = None
+        while True:
+            backend = await self._acquire(tried)
+            if backend is None:
+                raise error or RuntimeError("No Ollama backend configured")
+            tried.add(backend)
+
+            stream = None
+            try:
+                # La petición HTTP no sale hasta pedir el primer chunk
+                stream = await backend.client.generate(stream=True, **kwargs)
+                first = await anext(stream)
+                break
+            except BACKEND_ERRORS as e:
+                error = e
+                self.mark_failed(backend, e)
+                self.failovers += 1
+            except BaseException:
+                if stream is not None:
+                    await stream.aclose()
+                await self._release(backend)
+                raise
+            if stream is not None:
+                await stream.aclose()
+            await self._release(backend)
+
+        backend.healthy = True
+        backend.served += 1
+
+        async def chunks():
+            yield first
+            async for chunk in stream:
+                yield chunk
+
+        try:
+            yield chunks()
+        finally:
+            await stream.aclose()
+            await self._release(backend)
+
+    async def check(self, backend):
+        try:
+            await asyncio.wait_for(backend.client.ps(), self.health_timeout)
+        except (asyncio.TimeoutError, *BACKEND_ERRORS) as e:
+            if backend.healthy:
+                self.mark_failed(backend, e)
+            return False
+        if not backend.healthy:
+            logger.info("✅ Ollama backend is back host=%s", backend.host)
+            async with self._slots:
+                backend.healthy = True
+                # Cambia qué hosts pueden elegir los que esperan hueco
+                self._slots.notify_all()
+        return True
+
+    async def watch(self, interval=10.0):
+        """Health check periódico de todos los hosts."""
+        while True:
+            await asyncio.gather(*(self.check(backend) for backend in self.backends))
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        return {
+            "failovers": self.failovers,
+            "backends": [backend.stats() for backend in self.backends],
+        }
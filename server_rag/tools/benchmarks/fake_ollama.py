@@ -0,0 +1,108 @@
+"""Servidor falso que imita la API de streaming de Ollama, para pruebas locales.
+
+Responde a /api/generate (NDJSON con ``stream`` o respuesta única), /api/ps,
+/api/tags y /api/version con tiempos configurables, sin cargar ningún modelo.
+/state devuelve cuántos streams hay abiertos, el máximo simultáneo y cuántos
+se cortaron antes de acabar (el cliente cerró la conexión).
+
+Uso:
+    python benchmarks/fake_ollama.py --port 11500 --tokens 40 --token-delay 0.05
+    OLLAMA_HOSTS=http://127.0.0.1:11500,http://127.0.0.1:11501 uvicorn rag_api:app
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(tokens=40, first_delay=0.2, token_delay=0.05, fail_rate=0.0):
+    app = FastAPI()
+    state = {"active": 0, "max_active": 0, "served": 0, "aborted": 0, "failed": 0}
+
+    def chunk(model, text, done=False, **extra):
+        return {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": text,
+            "done": done,
+            **extra,
+        }
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": []}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    @app.get("/state")
+    async def get_state():
+        return state
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        if random.random() < fail_rate:
+            state["failed"] += 1
+            return JSONResponse({"error": "fake backend failure"}, status_code=500)
+
+        prompt_tokens = len(f"{body.get('system', '')} {body.get('prompt', '')}".split())
+        done = {
+            "done_reason": "stop",
+            "eval_count": tokens,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(first_delay * 1e9),
+        }
+        if not body.get("stream", True):
+            await asyncio.sleep(first_delay)
+            state["served"] += 1
+            return chunk(model, "hola", True, **done)
+
+        async def stream():
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+            finished = False
+            try:
+                await asyncio.sleep(first_delay)
+                for i in range(tokens):
+                    yield json.dumps(chunk(model, f"t{i} ")) + "\n"
+                    await asyncio.sleep(token_delay)
+                yield json.dumps(chunk(model, "", True, **done)) + "\n"
+                finished = True
+            finally:
+                state["active"] -= 1
+                state["served" if finished else "aborted"] += 1
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--first-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_app(args.tokens, args.first_delay, args.token_delay, args.fail_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Servidor falso que imita /drug/label.json de OpenFDA, para pruebas locales.
+
+Sirve ``--total`` etiquetas sintéticas paginadas con ``limit`` y ``skip``
+(404 cuando el skip supera el total, como OpenFDA) y falla con un 500 en una
+fracción ``--fail-rate`` de las peticiones. Con ``--seed`` los fallos salen
+siempre en el mismo orden, así que el backoff de fetch_page y la reanudación
+desde json_docs/skip.json se pueden repetir. /state devuelve cuántas
+peticiones y fallos hubo por skip.
+
+Uso:
+    python benchmarks/fake_openfda.py --port 11600 --total 5000 --fail-rate 0.3 --seed 1
+    python get_medications.py fetch --base-url http://127.0.0.1:11600/drug/label.json
+"""
+
+import argparse
+import asyncio
+import random
+from collections import defaultdict
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+INGREDIENTS = ("Ibuprofen", "Acetaminophen", "Naproxen", "Loratadine", "Cetirizine")
+
+
+def label(i):
+    """Etiqueta sintética i, siempre igual para el mismo índice."""
+    ingredient = INGREDIENTS[i % len(INGREDIENTS)]
+    return {
+        "set_id": f"fake-{i:08d}",
+        "openfda": {
+            "brand_name": [f"Fakebrand {i}"],
+            "manufacturer_name": ["Fake Labs"],
+        },
+        "active_ingredient": [f"{ingredient} 200 mg"],
+        "purpose": ["Pain reliever"],
+        "indications_and_usage": [f"Temporarily relieves minor aches ({ingredient})."],
+        "warnings": ["Do not exceed the recommended dose."],
+        "dosage_and_administration": ["Take 1 tablet every 4 to 6 hours."],
+    }
+
+
+def create_app(total=5000, fail_rate=0.0, delay=0.0, seed=None):
+    app = FastAPI()
+    rng = random.Random(seed)
+    requests_by_skip = defaultdict(int)
+    failures_by_skip = defaultdict(int)
+    state = {"requests": 0, "served": 0, "failed": 0}
+
+    @app.get("/state")
+    async def get_state():
+        return {
+            **state,
+            "requests_by_skip": requests_by_skip,
+            "failures_by_skip": failures_by_skip,
+        }
+
+    @app.get("/drug/label.json")
+    async def labels(limit: int = 1, skip: int = 0):
+        state["requests"] += 1
+        requests_by_skip[skip] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        if rng.random() < fail_rate:
+            state["failed"] += 1
+            failures_by_skip[skip] += 1
+            return JSONResponse(
+                {"error": {"code": "SERVER_ERROR", "message": "fake failure"}},
+                status_code=500,
+            )
+        if skip >= total:
+            return JSONResponse(
+                {"error": {"code": "NOT_FOUND", "message": "No matches found!"}},
+                status_code=404,
+            )
+
+        state["served"] += 1
+        return {
+            "meta": {"results": {"skip": skip, "limit": limit, "total": total}},
+            "results": [label(i) for i in range(skip, min(skip + limit, total))],
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11600)
+    parser.add_argument("--total", type=int, default=5000)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(args.total, args.fail_rate, args.delay, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
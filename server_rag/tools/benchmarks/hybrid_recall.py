@@ -0,0 +1,106 @@
+"""Recall@k y latencia p95: retrieval solo vectorial vs híbrido (BM25 + RRF).
+
+El conjunto de consultas es fijo: por defecto se generan desde la propia
+colección (cada ``--step``-ésimo nodo por sección de medicamento da la
+consulta "<nombre> <sección>" y ese nodo es el relevante). También se puede
+pasar un JSONL con ``{"query": ..., "relevant": [node_id, ...]}`` por línea.
+
+Uso (desde server_rag/tools, con ./storage indexado):
+    python benchmarks/hybrid_recall.py --top-k 2 --limit 200
+    python benchmarks/hybrid_recall.py --queries queries.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+from bm25 import BM25Index
+from retrieval import BatchedRetriever, HybridRetriever
+from section_parser import SECTION_TITLES
+
+
+def collection_queries(collection, step, limit):
+    """Consultas "<nombre> <sección>" con su nodo esperado, en orden de id."""
+    page = collection.get(where={"section": {"$ne": ""}}, include=["metadatas"])
+    pairs = sorted(zip(page["ids"], page["metadatas"]))
+    queries = []
+    for node_id, metadata in pairs[::step][:limit]:
+        title = SECTION_TITLES.get(metadata["section"], metadata["section"])
+        queries.append({"query": f"{metadata['name']} {title}", "relevant": [node_id]})
+    return queries
+
+
+def file_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def p95(values):
+    return statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+
+
+async def run(retrieve, queries, embeddings, top_k):
+    latencies, recalls = [], []
+    for query, embedding in zip(queries, embeddings):
+        start = time.perf_counter()
+        nodes = await retrieve(query["query"], top_k, embedding)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {node.node.node_id for node in nodes}
+        relevant = set(query["relevant"])
+        recalls.append(len(found & relevant) / len(relevant))
+    return statistics.mean(recalls), statistics.median(latencies), p95(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", help="JSONL con query/relevant")
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--step", type=int, default=7)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=10)
+    args = parser.parse_args()
+
+    embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    collection = chromadb.PersistentClient(path="./storage").get_or_create_collection("rag")
+    queries = (
+        file_queries(args.queries)
+        if args.queries
+        else collection_queries(collection, args.step, args.limit)
+    )
+    if not queries:
+        sys.exit("No hay consultas: indexa ./storage o pasa --queries")
+
+    bm25 = BM25Index("./storage/bm25.db")
+    bm25.load()
+    vector = BatchedRetriever(embed_model, collection, window_ms=0)
+    hybrid = HybridRetriever(vector, bm25, candidates=args.candidates)
+    # Embeddings fuera de la medida: las dos variantes reciben el mismo vector
+    embeddings = embed_model.get_text_embedding_batch([q["query"] for q in queries])
+
+    async def vector_only(prompt, top_k, embedding):
+        return await vector.retrieve(prompt, top_k=top_k, embedding=embedding)
+
+    async def hybrid_rrf(prompt, top_k, embedding):
+        return await hybrid.retrieve(prompt, top_k=top_k, embedding=embedding)
+
+    print(f"{len(queries)} consultas, top_k={args.top_k}")
+    print(f"{'variante':<12} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, retrieve in (("vectorial", vector_only), ("híbrido", hybrid_rrf)):
+        recall, p50, p95_ms = asyncio.run(run(retrieve, queries, embeddings, args.top_k))
+        print(f"{name:<12} {recall:>9.3f} {p50:>8.2f} {p95_ms:>8.2f}")
+
+    hybrid.shutdown()
+    vector.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""Prueba de carga de /context sin Ollama real.
+
+Monta un entorno de prueba completo en un directorio temporal:
+
+- un corpus pequeño y fijo en docs/ (incluido docs/meditime.md), indexado
+  con index_documents.py en una colección Chroma propia,
+- ``--hosts`` servidores falsos de Ollama (benchmarks/fake_ollama.py) con
+  retardo del primer token y velocidad de generación configurables,
+- rag_api con uvicorn apuntando a ellos.
+
+Para cada nivel de ``--concurrency`` lanza ``--requests`` peticiones a
+/context con ese número de streams abiertos a la vez y mide RPS, TTFB,
+latencia entre chunks y duración de cada stream (p50/p95/p99). El lag del
+event loop del servidor se estima con la latencia de ``GET /`` (no hace
+nada) medida en bucle durante la carga; el del propio cliente se mide
+también, para saber si el generador de carga era el cuello de botella.
+
+Cada prompt lleva un número de petición (sin coalescencia single-flight) y
+la caché semántica de respuestas queda desactivada salvo con
+``--response-cache``, para medir siempre la generación completa. El
+resultado es JSON (``--output``); con ``--compare`` se imprime la diferencia
+con otro resultado, p. ej. el del commit anterior.
+
+Uso (desde server_rag/tools):
+    python benchmarks/load_test.py --concurrency 1 8 32 --requests 200 --output run.json
+    python benchmarks/load_test.py --token-rate 50 --first-delay 0.5 --compare run.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_OLLAMA = os.path.join(TOOLS_DIR, "benchmarks", "fake_ollama.py")
+INDEX_DOCUMENTS = os.path.join(TOOLS_DIR, "index_documents.py")
+
+# Corpus fijo: mismo índice en cada ejecución
+CORPUS = {
+    "meditime.md": """# MediTime
+
+MediTime es una aplicación para organizar la medicación diaria. Permite
+registrar cada medicamento con su dosis y horario y avisa con un
+recordatorio cuando toca tomarlo.
+
+## Recordatorios
+
+Los recordatorios se configuran por medicamento: hora, días de la semana y
+número de tomas. Si una toma se pospone, la aplicación vuelve a avisar a
+los 15 minutos.
+
+## Historial
+
+El historial muestra las tomas confirmadas y las olvidadas de los últimos
+90 días y se puede exportar en PDF para el médico.
+""",
+    "paracetamol.md": """# Paracetamol
+
+El paracetamol (acetaminofén) se usa para el dolor leve o moderado y para
+bajar la fiebre.
+
+## Dosis
+
+Adultos: 500 mg a 1 g cada 6 a 8 horas, sin pasar de 3 g al día sin
+indicación médica. Niños: según el peso, 10 a 15 mg/kg por toma.
+
+## Advertencias
+
+Dosis altas pueden dañar el hígado. No combinar con otros productos que
+contengan paracetamol ni con alcohol.
+""",
+    "ibuprofeno.md": """# Ibuprofeno
+
+El ibuprofeno es un antiinflamatorio no esteroideo (AINE) para el dolor, la
+inflamación y la fiebre.
+
+## Dosis
+
+Adultos: 200 a 400 mg cada 6 a 8 horas con comida, máximo 1200 mg al día
+sin receta.
+
+## Advertencias
+
+Puede irritar el estómago. Evitarlo con úlcera, insuficiencia renal o en
+el tercer trimestre del embarazo.
+""",
+    "aspirin.md": """# Aspirin
+
+Aspirin (acetylsalicylic acid) relieves pain, fever and inflammation, and
+in low doses prevents blood clots.
+
+## Dosage
+
+Adults: 325 to 650 mg every 4 hours as needed. Low-dose therapy: 81 mg once
+a day, only under medical supervision.
+
+## Warnings
+
+Do not give to children or teenagers with viral infections (Reye's
+syndrome). Take with food to reduce stomach upset.
+""",
+    "loratadina.md": """# Loratadina
+
+La loratadina es un antihistamínico que alivia los síntomas de la alergia:
+estornudos, picor de nariz y ojos y urticaria.
+
+## Dosis
+
+Adultos y niños mayores de 12 años: 10 mg una vez al día.
+
+## Advertencias
+
+Puede causar somnolencia leve. Consultar con el médico en caso de
+enfermedad hepática.
+""",
+}
+
+PROMPTS = [
+    ("¿Cada cuánto puedo tomar paracetamol?", "es"),
+    ("¿El ibuprofeno se toma con comida?", "es"),
+    ("What is the low dose of aspirin?", "en"),
+    ("¿Cómo configuro un recordatorio en MediTime?", "es"),
+    ("¿La loratadina da sueño?", "es"),
+    ("Can I export my MediTime history?", "en"),
+]
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def summary(values, scale=1000.0):
+    """p50/p95/p99/max/mean (por defecto en ms) de una lista de segundos."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(pct):
+        k = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[k]
+
+    return {
+        "p50": round(pick(50) * scale, 2),
+        "p95": round(pick(95) * scale, 2),
+        "p99": round(pick(99) * scale, 2),
+        "max": round(ordered[-1] * scale, 2),
+        "mean": round(sum(ordered) / len(ordered) * scale, 2),
+        "count": len(ordered),
+    }
+
+
+def build_index(workdir):
+    docs = os.path.join(workdir, "docs")
+    os.makedirs(docs, exist_ok=True)
+    for name, text in CORPUS.items():
+        with open(os.path.join(docs, name), "w", encoding="utf-8") as f:
+            f.write(text)
+    subprocess.run(
+        [sys.executable, INDEX_DOCUMENTS, "--full", "--labels", "", "--workers", "1"],
+        cwd=workdir,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(url, timeout=120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+def start_fake_ollama(port, args):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            FAKE_OLLAMA,
+            "--port",
+            str(port),
+            "--tokens",
+            str(args.tokens),
+            "--first-delay",
+            str(args.first_delay),
+            "--token-delay",
+            str(1.0 / args.token_rate),
+        ]
+    )
+
+
+def start_api(workdir, port, hosts, args):
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [TOOLS_DIR, os.getenv("PYTHONPATH")])
+        ),
+        "OLLAMA_HOSTS": ",".join(hosts),
+        "RAG_OLLAMA_MAX_STREAMS_PER_HOST": str(args.streams_per_host),
+        "RAG_EMBED_CACHE_PATH": "",
+        "RAG_LOG_LEVEL": "WARNING",
+    }
+    if not args.response_cache:
+        # Ningún contexto está a distancia < 0: nunca acierta
+        env["RAG_RESPONSE_CACHE_MAX_DISTANCE"] = "-1"
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    # El proceso hereda el descriptor; aquí se puede cerrar
+    with open(os.path.join(workdir, "rag_api.log"), "w") as log_file:
+        return subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "rag_api:app",
+                "--port",
+                str(port),
+                "--log-level",
+                "warning",
+            ],
+            cwd=workdir,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+
+
+async def one_stream(client, url, prompt, lang):
+    start = time.perf_counter()
+    ttfb = None
+    gaps = []
+    async with client.stream(
+        "POST", f"{url}/context", json={"prompt": prompt, "lang": lang}
+    ) as response:
+        last = None
+        async for chunk in response.aiter_bytes():
+            if not chunk:
+                continue
+            now = time.perf_counter()
+            if ttfb is None:
+                ttfb = now - start
+            else:
+                gaps.append(now - last)
+            last = now
+    return {
+        "status": response.status_code,
+        "ttfb": ttfb,
+        "gaps": gaps,
+        "total": time.perf_counter() - start,
+    }
+
+
+async def probe_server(client, url, stop, samples):
+    """Latencia de GET / (endpoint vacío): sube cuando el event loop se bloquea."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await client.get(f"{url}/")
+            samples.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.05)
+
+
+async def probe_client(stop, samples, interval=0.01):
+    """Retraso de un sleep(interval) en el propio cliente."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def run_level(url, concurrency, requests):
+    limits = httpx.Limits(max_connections=concurrency + 2)
+    timeout = httpx.Timeout(300.0, connect=10.0)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        stop = asyncio.Event()
+        server_lag, client_lag = [], []
+        probes = [
+            asyncio.create_task(probe_server(client, url, stop, server_lag)),
+            asyncio.create_task(probe_client(stop, client_lag)),
+        ]
+        next_request = iter(range(requests))
+        results = []
+
+        async def worker():
+            for i in next_request:
+                prompt, lang = PROMPTS[i % len(PROMPTS)]
+                try:
+                    results.append(
+                        await one_stream(client, url, f"{prompt} (#{i})", lang)
+                    )
+                except httpx.HTTPError as e:
+                    results.append({"status": type(e).__name__})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*probes)
+
+    ok = [r for r in results if r["status"] == 200]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "statuses": statuses,
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(ok) / elapsed, 2),
+        "ttfb_ms": summary([r["ttfb"] for r in ok if r["ttfb"] is not None]),
+        "inter_chunk_ms": summary([gap for r in ok for gap in r["gaps"]]),
+        "stream_ms": summary([r["total"] for r in ok]),
+        "event_loop_lag_ms": summary(server_lag),
+        "client_loop_lag_ms": summary(client_lag),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=TOOLS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline):
+    """Tabla de diferencias por nivel de concurrencia (positivo = más)."""
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    metrics = [
+        ("rps", None),
+        ("ttfb_ms", "p50"),
+        ("ttfb_ms", "p95"),
+        ("ttfb_ms", "p99"),
+        ("inter_chunk_ms", "p99"),
+        ("event_loop_lag_ms", "p99"),
+    ]
+    log(f"Comparado con {baseline['meta'].get('commit')}:")
+    for level in current["levels"]:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        log(f"  concurrency={level['concurrency']}")
+        for name, key in metrics:
+            new, old = level[name], before[name]
+            if key is not None:
+                new, old = (new or {}).get(key), (old or {}).get(key)
+            if new is None or old is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            label = f"{name}.{key}" if key else name
+            log(f"    {label:<24} {old:>10.2f} -> {new:>10.2f}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--requests", type=int, default=100, help="Peticiones por nivel"
+    )
+    parser.add_argument("--hosts", type=int, default=1, help="Servidores Ollama falsos")
+    parser.add_argument("--streams-per-host", type=int, default=32)
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens por respuesta")
+    parser.add_argument(
+        "--token-rate", type=float, default=40.0, help="Tokens/s por stream"
+    )
+    parser.add_argument(
+        "--first-delay", type=float, default=0.2, help="Segundos hasta el primer token"
+    )
+    parser.add_argument("--response-cache", action="store_true")
+    parser.add_argument(
+        "--env", action="append", default=[], help="KEY=VALUE extra para rag_api"
+    )
+    parser.add_argument(
+        "--workdir", help="Directorio de trabajo (por defecto, uno temporal)"
+    )
+    parser.add_argument("--base-port", type=int, default=11700)
+    parser.add_argument(
+        "--output", help="Fichero JSON de resultados (por defecto, stdout)"
+    )
+    parser.add_argument("--compare", help="Resultado JSON anterior con el que comparar")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="rag-load-") as tmp:
+        workdir = args.workdir or tmp
+        log(f"Indexando el corpus en {workdir}...")
+        build_index(workdir)
+
+        api_url = f"http://127.0.0.1:{args.base_port}"
+        hosts = [
+            f"http://127.0.0.1:{args.base_port + 1 + i}" for i in range(args.hosts)
+        ]
+        processes = [
+            start_fake_ollama(args.base_port + 1 + i, args) for i in range(args.hosts)
+        ]
+        try:
+            for host in hosts:
+                wait_ready(f"{host}/api/version")
+            processes.append(start_api(workdir, args.base_port, hosts, args))
+            wait_ready(f"{api_url}/")
+
+            levels = []
+            for concurrency in args.concurrency:
+                log(f"concurrency={concurrency}, {args.requests} peticiones...")
+                levels.append(
+                    asyncio.run(run_level(api_url, concurrency, args.requests))
+                )
+                log(
+                    f"  {levels[-1]['rps']} rps, ttfb p95 "
+                    f"{(levels[-1]['ttfb_ms'] or {}).get('p95')} ms"
+                )
+            health = httpx.get(f"{api_url}/health").json()
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("output", "compare", "workdir")
+            },
+        },
+        "levels": levels,
+        "server": {
+            "generations": health.get("generations"),
+            "admission": health.get("admission"),
+        },
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        log(f"Resultados en {args.output}")
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
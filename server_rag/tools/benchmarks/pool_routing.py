@@ -0,0 +1,123 @@
+"""Prueba el BackendPool contra servidores Ollama falsos locales.
+
+Arranca ``--hosts`` copias de benchmarks/fake_ollama.py (la última falla
+siempre) y añade un host sin servidor. Lanza ``--streams`` generaciones a la
+vez a través del pool y comprueba que:
+
+- todas terminan pese al host caído y al que falla (failover),
+- ningún host supera ``--max-streams`` streams simultáneos,
+- el reparto entre los hosts sanos es parejo (menos cargado primero).
+
+Uso (desde server_rag/tools):
+    python benchmarks/pool_routing.py --hosts 3 --streams 40 --max-streams 4
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from backend_pool import BackendPool
+
+FAKE_OLLAMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_ollama.py")
+
+
+def start_fake(port, fail_rate):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            FAKE_OLLAMA,
+            "--port",
+            str(port),
+            "--tokens",
+            "20",
+            "--token-delay",
+            "0.01",
+            "--fail-rate",
+            str(fail_rate),
+        ]
+    )
+
+
+def wait_ready(url, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{url}/api/version", timeout=0.5)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def run(pool, streams):
+    async def one(i):
+        async with pool.generate(model="fake", prompt=f"prompt {i}") as stream:
+            return sum([1 async for chunk in stream if not chunk.done])
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(streams)), return_exceptions=True)
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hosts", type=int, default=3)
+    parser.add_argument("--streams", type=int, default=40)
+    parser.add_argument("--max-streams", type=int, default=4)
+    parser.add_argument("--base-port", type=int, default=11600)
+    args = parser.parse_args()
+
+    urls = [f"http://127.0.0.1:{args.base_port + i}" for i in range(args.hosts)]
+    failing = urls[-1]
+    processes = [start_fake(args.base_port + i, 1.0 if url == failing else 0.0) for i, url in enumerate(urls)]
+    dead = f"http://127.0.0.1:{args.base_port + args.hosts}"
+    try:
+        for url in urls:
+            wait_ready(url)
+
+        pool = BackendPool([dead, *urls], max_streams_per_host=args.max_streams)
+        results, elapsed = asyncio.run(run(pool, args.streams))
+        states = {url: httpx.get(f"{url}/state").json() for url in urls}
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    print(f"{args.streams} streams en {elapsed:.2f}s, {len(errors)} errores, "
+          f"{pool.failovers} failovers")
+    for backend in pool.backends:
+        state = states.get(backend.host, {})
+        print(
+            f"  {backend.host:<26} served={backend.served:<4} failures={backend.failures:<4} "
+            f"max_active={state.get('max_active', '-')}"
+        )
+
+    healthy = [b for b in pool.backends if b.host not in (dead, failing)]
+    checks = {
+        "todas las generaciones terminan": not errors,
+        "ningún host supera max-streams": all(
+            s["max_active"] <= args.max_streams for s in states.values()
+        ),
+        "reparto parejo entre hosts sanos": max(b.served for b in healthy)
+        - min(b.served for b in healthy)
+        <= args.max_streams,
+        "los hosts caídos quedan marcados": not any(
+            b.healthy for b in pool.backends if b.host in (dead, failing)
+        ),
+    }
+    for name, ok in checks.items():
+        print(f"{'✅' if ok else '❌'} {name}")
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Tiempo de evaluación del prompt en Ollama: system prompt en línea vs campo system.
+
+Antes: /context mandaba un único ``prompt`` con system prompt + contexto +
+pregunta. Ahora: el system prompt precalculado por idioma va en el campo
+``system`` y el prompt solo lleva contexto y pregunta, así que el prefijo
+es idéntico en cada petición del mismo idioma y Ollama reutiliza su KV cache.
+
+Cada variante recorre las mismas peticiones (idiomas alternos, contextos
+distintos) con ``num_predict=1`` para medir solo la evaluación del prompt, a
+partir de ``prompt_eval_count`` y ``prompt_eval_duration``.
+
+Uso (desde server_rag/tools, con Ollama corriendo):
+    python benchmarks/prompt_eval.py --rounds 10 --langs es en
+"""
+
+import argparse
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ollama
+
+from config import MODELO, OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE
+from prompts import build_system_prompt
+
+REQUESTS = [
+    (
+        "Advil - Dosage Recommendations:\nAdults: take 1 tablet every 4 to 6 hours.",
+        "¿Cada cuánto puedo tomar Advil?",
+    ),
+    (
+        "Tylenol - Warnings:\nLiver warning: this product contains acetaminophen.",
+        "Is Tylenol safe for my liver?",
+    ),
+    (
+        "Loratadine - Indications:\nTemporarily relieves symptoms of hay fever.",
+        "¿Para qué sirve la loratadina?",
+    ),
+]
+
+
+def run(client, model, layout, system_prompts, langs, rounds):
+    durations, counts = [], []
+    for i in range(rounds):
+        for j, (context, question) in enumerate(REQUESTS):
+            lang = langs[(i + j) % len(langs)]
+            prompt = f"{context}\n\n{question}"
+            if layout == "inline":
+                kwargs = {"prompt": f"{system_prompts[lang]}\n\n{prompt}"}
+            else:
+                kwargs = {"system": system_prompts[lang], "prompt": prompt}
+            response = client.generate(
+                model=model,
+                stream=False,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+                options={"num_predict": 1},
+                **kwargs,
+            )
+            durations.append((response.prompt_eval_duration or 0) / 1e6)
+            counts.append(response.prompt_eval_count or 0)
+    return durations, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default=OLLAMA_BASE_URL)
+    parser.add_argument("--model", default=MODELO)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--langs", nargs="+", default=["es", "en"])
+    args = parser.parse_args()
+
+    client = ollama.Client(host=args.host)
+    system_prompts = {lang: build_system_prompt(lang) for lang in args.langs}
+    # Carga el modelo antes de medir
+    client.generate(model=args.model, prompt="Hola", stream=False, keep_alive=OLLAMA_KEEP_ALIVE)
+
+    print(f"{'variante':<8} {'tokens eval.':>12} {'p50 ms':>8} {'media ms':>9}")
+    for layout in ("inline", "system"):
+        durations, counts = run(
+            client, args.model, layout, system_prompts, args.langs, args.rounds
+        )
+        print(
+            f"{layout:<8} {statistics.mean(counts):>12.1f} "
+            f"{statistics.median(durations):>8.1f} {statistics.mean(durations):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Micro-benchmark del coste por petición de preparar el retrieval.
+
+Antes: cada /context construía ``index.as_retriever(similarity_top_k=k)``.
+Ahora: la etapa BatchedRetriever se crea una vez al arrancar y cada petición
+solo encola su prompt con su ``top_k``.
+
+Uso (desde server_rag/tools, con ./storage indexado):
+    python benchmarks/retriever_setup.py --iterations 2000 --top-k 2
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from retrieval import BatchedRetriever
+
+PROMPT = "¿Para qué sirve el paracetamol?"
+
+
+def per_call_us(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+class _NoopBatchedRetriever(BatchedRetriever):
+    """BatchedRetriever sin embedding ni Chroma: solo queda lo que añade la
+    etapa a cada petición (encolar en _submit, flush al pool y future)."""
+
+    def _retrieve_batch(self, items):
+        return [[] for _ in items]
+
+
+async def new_path(retriever, top_k, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await retriever.retrieve(PROMPT, top_k)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--retrievals", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=2)
+    args = parser.parse_args()
+
+    Settings.llm = None
+    Settings.embed_model = HuggingFaceEmbedding(
+        model_name="sentence-transformers/all-MiniLM-L6-v2"
+    )
+    chroma_collection = chromadb.PersistentClient(
+        path="./storage"
+    ).get_or_create_collection("rag")
+    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    index = VectorStoreIndex.from_vector_store(vector_store)
+
+    setup_us = per_call_us(
+        lambda: index.as_retriever(similarity_top_k=args.top_k), args.iterations
+    )
+    print(f"as_retriever() por petición: {setup_us:9.1f} µs")
+    noop = _NoopBatchedRetriever(None, None, window_ms=0)
+    submit_us = asyncio.run(new_path(noop, args.top_k, args.iterations))
+    noop.shutdown()
+    print(f"etapa pre-construida:        {submit_us:9.1f} µs (encolar y esperar el future)")
+
+    old_us = per_call_us(
+        lambda: index.as_retriever(similarity_top_k=args.top_k).retrieve(PROMPT),
+        args.retrievals,
+    )
+    retriever = BatchedRetriever(Settings.embed_model, chroma_collection, window_ms=0)
+    new_us = asyncio.run(new_path(retriever, args.top_k, args.retrievals))
+    retriever.shutdown()
+
+    print(f"retrieval completo antes:    {old_us / 1000:9.2f} ms")
+    print(f"retrieval completo ahora:    {new_us / 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
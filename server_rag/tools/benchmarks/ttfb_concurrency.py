@@ -0,0 +1,100 @@
+"""Mide el time-to-first-byte de /context a medida que suben los streams en vuelo.
+
+Uso (con rag_api corriendo):
+    python benchmarks/ttfb_concurrency.py --url http://127.0.0.1:8000 --levels 1 2 4 8 16 32
+
+Mientras los streams están abiertos se consulta /health en bucle: si el event
+loop del servidor se bloquea leyendo de Ollama, la latencia de /health lo delata.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+PROMPTS = [
+    "¿Para qué sirve el paracetamol?",
+    "What is MediTime?",
+    "Efectos secundarios del ibuprofeno",
+    "Can I take aspirin with food?",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+async def one_stream(client, url, prompt, lang):
+    start = time.perf_counter()
+    ttfb = None
+    async with client.stream(
+        "POST", f"{url}/context", json={"prompt": prompt, "lang": lang}
+    ) as r:
+        async for chunk in r.aiter_bytes():
+            if ttfb is None and chunk:
+                ttfb = time.perf_counter() - start
+    return ttfb, time.perf_counter() - start
+
+
+async def probe_health(client, url, stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await client.get(f"{url}/health")
+            samples.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.05)
+
+
+async def run_level(url, n, lang):
+    limits = httpx.Limits(max_connections=n + 4)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        stop = asyncio.Event()
+        health = []
+        prober = asyncio.create_task(probe_health(client, url, stop, health))
+        results = await asyncio.gather(
+            *[
+                one_stream(client, url, PROMPTS[i % len(PROMPTS)], lang)
+                for i in range(n)
+            ],
+            return_exceptions=True,
+        )
+        stop.set()
+        await prober
+
+    ttfbs = [r[0] for r in results if isinstance(r, tuple) and r[0] is not None]
+    errors = sum(1 for r in results if isinstance(r, BaseException))
+    return {
+        "streams": n,
+        "ttfb_p50": statistics.median(ttfbs) if ttfbs else float("nan"),
+        "ttfb_p95": percentile(ttfbs, 95),
+        "health_p95": percentile(health, 95),
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--lang", default="es")
+    args = parser.parse_args()
+
+    print(f"{'streams':>8} {'ttfb p50':>10} {'ttfb p95':>10} {'/health p95':>12} {'errors':>7}")
+    for n in args.levels:
+        row = await run_level(args.url, n, args.lang)
+        print(
+            f"{row['streams']:>8} {row['ttfb_p50']:>9.3f}s {row['ttfb_p95']:>9.3f}s "
+            f"{row['health_p95']:>11.3f}s {row['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+# Palabras vacías frecuentes en los prompts (es/en/fr); los nombres de
+# medicamentos, dosis y unidades se conservan.
+STOPWORDS = frozenset(
+    """
+    a al algo como con cual cuales de del el en es esta este for how i in is it
+    la las le les lo los me mi my of on or para por que se si su the to un
+    una uno what y you est et il je pour pas des du au
+    """.split()
+)
+
+
+def tokenize(text: str):
+    """Tokens para BM25: sin acentos ni mayúsculas, sin palabras vacías."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _WORD.findall(text) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _join(strings):
+    """Lista de textos como un array de bytes separados por NUL (sin pickle)."""
+    return np.frombuffer("\0".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _split(array):
+    return array.tobytes().decode("utf-8").split("\0") if len(array) else []
+
+
+class BM25Index:
+    """Índice léxico BM25 de los nodos de la colección Chroma ``rag``.
+
+    index_documents.py lo mantiene en ``storage/bm25.db`` (SQLite, una fila
+    por término y nodo) con los mismos ids que Chroma, así que se actualiza
+    de forma incremental igual que los vectores. Al acabar, ``export`` deja
+    las postings ordenadas por término en ``storage/bm25.npz`` y rag_api las
+    carga de ahí como arrays de numpy, con los pesos BM25 calculados de una
+    vez: una búsqueda solo suma ``idf * peso`` de los términos del prompt.
+    """
+
+    def __init__(self, db_path, k1=1.2, b=0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self._db = None
+        # (ids de nodo, término -> índice, offsets, posiciones, pesos, idf)
+        self._state = ([], {}, None, None, None, None)
+
+    # -- Escritura (index_documents.py) --
+
+    def open(self):
+        self._db = sqlite3.connect(self.db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS docs (node_id TEXT PRIMARY KEY, length INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, node_id)
+            ) WITHOUT ROWID"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS postings_node ON postings (node_id)")
+        return self
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def count(self):
+        return self._db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add(self, node_ids, texts):
+        docs, postings = [], []
+        for node_id, text in zip(node_ids, texts):
+            terms = Counter(tokenize(text))
+            docs.append((node_id, sum(terms.values())))
+            postings += [(term, node_id, tf) for term, tf in terms.items()]
+        self.remove(node_ids)
+        self._db.executemany("INSERT INTO docs VALUES (?, ?)", docs)
+        self._db.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+
+    def remove(self, node_ids):
+        for i in range(0, len(node_ids), 500):
+            batch = list(node_ids[i : i + 500])
+            marks = ", ".join("?" for _ in batch)
+            self._db.execute(f"DELETE FROM docs WHERE node_id IN ({marks})", batch)
+            self._db.execute(f"DELETE FROM postings WHERE node_id IN ({marks})", batch)
+
+    def clear(self):
+        self._db.execute("DELETE FROM docs")
+        self._db.execute("DELETE FROM postings")
+
+    def commit(self):
+        self._db.commit()
+
+    def snapshot_path(self):
+        """Arrays del índice que escribe ``export`` y lee ``load``."""
+        return f"{os.path.splitext(self.db_path)[0]}.npz"
+
+    def _read_arrays(self, db):
+        """(ids de nodo, longitudes, términos, offsets, posiciones, tfs).
+
+        Las postings de ``terms[i]`` son ``docs[offsets[i]:offsets[i + 1]]``.
+        Se leen en el orden de la clave primaria (term, node_id), columna a
+        columna con np.fromiter, sin listas de Python por posting.
+        """
+        node_ids, lengths = [], []
+        for node_id, length in db.execute("SELECT node_id, length FROM docs"):
+            node_ids.append(node_id)
+            lengths.append(length)
+        positions = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        terms, counts = [], []
+        for term, count in db.execute(
+            "SELECT term, COUNT(*) FROM postings GROUP BY term ORDER BY term"
+        ):
+            terms.append(term)
+            counts.append(count)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        total = int(offsets[-1])
+        docs = np.fromiter(
+            (
+                positions[node_id]
+                for (node_id,) in db.execute(
+                    "SELECT node_id FROM postings ORDER BY term, node_id"
+                )
+            ),
+            dtype=np.int32,
+            count=total,
+        )
+        tfs = np.fromiter(
+            (tf for (tf,) in db.execute("SELECT tf FROM postings ORDER BY term, node_id")),
+            dtype=np.float32,
+            count=total,
+        )
+        return node_ids, np.asarray(lengths, dtype=np.float32), terms, offsets, docs, tfs
+
+    def export(self):
+        """Guarda los arrays del índice junto a la base para que rag_api los
+        cargue sin recorrer las postings fila a fila."""
+        self._db.commit()
+        node_ids, lengths, terms, offsets, docs, tfs = self._read_arrays(self._db)
+        path = self.snapshot_path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                node_ids=_join(node_ids),
+                lengths=lengths,
+                terms=_join(terms),
+                offsets=offsets,
+                docs=docs,
+                tfs=tfs,
+            )
+        os.replace(tmp_path, path)
+        return len(node_ids)
+
+    # -- Lectura (rag_api.py) --
+
+    def load(self):
+        """Carga el índice en memoria. Devuelve el número de nodos.
+
+        Lee los arrays de ``export``; si faltan o son más antiguos que la base
+        (índice de una versión anterior) los calcula desde SQLite.
+        """
+        if not os.path.exists(self.db_path):
+            self._state = ([], {}, None, None, None, None)
+            return 0
+
+        snapshot = self.snapshot_path()
+        if (
+            os.path.exists(snapshot)
+            and os.stat(snapshot).st_mtime >= os.stat(self.db_path).st_mtime
+        ):
+            with np.load(snapshot) as data:
+                node_ids = _split(data["node_ids"])
+                terms = _split(data["terms"])
+                lengths, offsets = data["lengths"], data["offsets"]
+                docs, tfs = data["docs"], data["tfs"]
+        else:
+            db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            try:
+                node_ids, lengths, terms, offsets, docs, tfs = self._read_arrays(db)
+            except sqlite3.OperationalError:
+                return 0  # Todavía sin tablas
+            finally:
+                db.close()
+
+        # Pesos BM25 de todas las postings de una vez
+        total = len(node_ids)
+        avgdl = float(lengths.mean()) if total else 1.0
+        norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avgdl)
+        weights = tfs * (self.k1 + 1) / (tfs + norm)
+        df = np.diff(offsets)
+        idf = np.log1p((total - df + 0.5) / (df + 0.5)).astype(np.float32)
+        term_index = dict(zip(terms, range(len(terms))))
+
+        # Se sustituye de una vez: search() nunca ve un índice a medias
+        self._state = (node_ids, term_index, offsets, docs, weights, idf)
+        return total
+
+    async def watch(self, version_path, interval=5.0):
+        """Recarga el índice cuando index_documents.py toca version_path."""
+
+        def read_version():
+            try:
+                return os.stat(version_path).st_mtime
+            except OSError:
+                return None
+
+        loaded = read_version()
+        while True:
+            await asyncio.sleep(interval)
+            version = read_version()
+            if version != loaded:
+                loaded = version
+                count = await asyncio.to_thread(self.load)
+                logger.info("♻️ BM25 index reloaded nodes=%d", count)
+
+    def search(self, query: str, top_k: int):
+        """[(node_id, score)] de los top_k nodos con mejor BM25."""
+        node_ids, term_index, offsets, docs, weights, idf = self._state
+        terms = [term_index[term] for term in set(tokenize(query)) if term in term_index]
+        if not terms:
+            return []
+
+        scores = np.zeros(len(node_ids), dtype=np.float32)
+        for i in terms:
+            start, end = offsets[i], offsets[i + 1]
+            scores[docs[start:end]] += idf[i] * weights[start:end]
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(node_ids[i], float(scores[i])) for i in candidates]
+
+    def stats(self):
+        node_ids, term_index, *_ = self._state
+        return {"nodes": len(node_ids), "terms": len(term_index)}
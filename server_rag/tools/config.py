@@ -0,0 +1,110 @@
+import os
+
+# Configuración del servidor RAG. Cada valor puede sobreescribirse con una
+# variable de entorno del mismo nombre (ver server_rag/.env).
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Hosts de Ollama entre los que se reparten las generaciones (separados por
+# comas), streams simultáneos por host y cada cuánto se comprueba su salud
+OLLAMA_HOSTS = tuple(
+    host.strip() for host in os.getenv("OLLAMA_HOSTS", OLLAMA_BASE_URL).split(",") if host.strip()
+)
+OLLAMA_MAX_STREAMS_PER_HOST = int(os.getenv("RAG_OLLAMA_MAX_STREAMS_PER_HOST", "4"))
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("RAG_OLLAMA_HEALTH_INTERVAL", "10"))
+MODELO = os.getenv("RAG_MODEL", "llama3")
+
+# Segundos máximos esperando el primer chunk de Ollama
+FIRST_CHUNK_TIMEOUT = float(os.getenv("RAG_FIRST_CHUNK_TIMEOUT", "60"))
+
+# Etapa de retrieval: ventana para agrupar prompts, tamaño máximo de batch y
+# número de hilos dedicados al embedding + consulta a Chroma
+RETRIEVAL_BATCH_WINDOW_MS = float(os.getenv("RAG_RETRIEVAL_BATCH_WINDOW_MS", "5"))
+RETRIEVAL_MAX_BATCH = int(os.getenv("RAG_RETRIEVAL_MAX_BATCH", "32"))
+RETRIEVAL_WORKERS = int(os.getenv("RAG_RETRIEVAL_WORKERS", "2"))
+
+# Nodos recuperados por defecto en /context y máximo que puede pedir un cliente
+DEFAULT_TOP_K = int(os.getenv("RAG_DEFAULT_TOP_K", "2"))
+MAX_TOP_K = int(os.getenv("RAG_MAX_TOP_K", "8"))
+
+# Caché de embeddings de consulta (prompt normalizado -> vector). Con
+# EMBED_CACHE_PATH vacío no se guarda en disco.
+EMBED_CACHE_SIZE = int(os.getenv("RAG_EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_TTL = float(os.getenv("RAG_EMBED_CACHE_TTL", "86400"))
+EMBED_CACHE_PATH = os.getenv("RAG_EMBED_CACHE_PATH", "./storage/embed_cache.pkl")
+
+# Caché semántica de respuestas de /context: distancia coseno máxima para
+# reutilizar un contexto generado para un prompt parecido del mismo idioma.
+# index_documents.py toca INDEX_VERSION_PATH al reindexar, lo que la vacía.
+RESPONSE_CACHE_SIZE = int(os.getenv("RAG_RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RAG_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_DISTANCE = float(os.getenv("RAG_RESPONSE_CACHE_MAX_DISTANCE", "0.08"))
+INDEX_VERSION_PATH = os.getenv("RAG_INDEX_VERSION_PATH", "./storage/index_version")
+
+# Documento de respaldo para preguntas sobre la app MediTime
+MEDITIME_DOC_PATH = os.getenv("RAG_MEDITIME_DOC_PATH", "./docs/meditime.md")
+MEDITIME_MAX_CHUNKS = int(os.getenv("RAG_MEDITIME_MAX_CHUNKS", "3"))
+
+# Búsqueda directa por nombre de medicamento (tabla labels de
+# index_documents.py): máximo de medicamentos por prompt, de productos que
+# se asocian a un mismo principio activo y de productos que pueden compartir
+# un nombre comercial (si son más, el nombre es genérico y se ignora)
+DRUG_LOOKUP_DB = os.getenv("RAG_DRUG_LOOKUP_DB", "./json_docs/medications.db")
+DRUG_LOOKUP_MAX_DRUGS = int(os.getenv("RAG_DRUG_LOOKUP_MAX_DRUGS", "3"))
+DRUG_LOOKUP_PER_INGREDIENT = int(os.getenv("RAG_DRUG_LOOKUP_PER_INGREDIENT", "3"))
+DRUG_LOOKUP_MAX_LABELS_PER_NAME = int(
+    os.getenv("RAG_DRUG_LOOKUP_MAX_LABELS_PER_NAME", "5")
+)
+# Distancia L2² máxima (embeddings normalizados: 2 - 2·coseno) entre el prompt
+# y una sección leída por nombre; las más lejanas se descartan por si el
+# nombre coincidió por error ("0" desactiva el corte)
+DRUG_LOOKUP_MAX_DISTANCE = float(os.getenv("RAG_DRUG_LOOKUP_MAX_DISTANCE", "1.5"))
+
+# Retrieval híbrido: BM25 (índice de index_documents.py) y vectorial en
+# paralelo, fusionados con RRF. Cada etapa tiene un presupuesto en ms; si se
+# pasa, se usa solo el resultado de la otra.
+BM25_PATH = os.getenv("RAG_BM25_PATH", "./storage/bm25.db")
+HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+VECTOR_BUDGET_MS = float(os.getenv("RAG_VECTOR_BUDGET_MS", "300"))
+BM25_BUDGET_MS = float(os.getenv("RAG_BM25_BUDGET_MS", "150"))
+
+# Presupuesto de tokens del prompt de /context (system + contexto + prompt).
+# Ollama usa num_ctx=2048 por defecto: se deja sitio para la respuesta. Un
+# nodo que no cabe entero se corta solo si quedan al menos
+# CONTEXT_MIN_CHUNK_TOKENS tokens libres.
+PROMPT_MAX_TOKENS = int(os.getenv("RAG_PROMPT_MAX_TOKENS", "1536"))
+CONTEXT_MIN_CHUNK_TOKENS = int(os.getenv("RAG_CONTEXT_MIN_CHUNK_TOKENS", "24"))
+
+# Tiempo que Ollama mantiene el modelo (y su KV cache) cargado
+OLLAMA_KEEP_ALIVE = os.getenv("RAG_OLLAMA_KEEP_ALIVE", "1h")
+
+# Idiomas con system prompt precalculado al arrancar (separados por comas)
+SYSTEM_PROMPT_LANGS = tuple(
+    lang.strip() for lang in os.getenv("RAG_SYSTEM_PROMPT_LANGS", "es,en,fr").split(",")
+)
+
+# Control de admisión de /context: generaciones en vuelo (0 = hosts de Ollama
+# x streams por host), peticiones en cola, segundos máximos en cola y parte
+# de la cola que pueden ocupar las peticiones de prioridad batch
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("RAG_ADMISSION_MAX_IN_FLIGHT", "0"))
+ADMISSION_MAX_QUEUE = int(os.getenv("RAG_ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("RAG_ADMISSION_QUEUE_TIMEOUT", "15"))
+ADMISSION_BATCH_QUEUE_SHARE = float(os.getenv("RAG_ADMISSION_BATCH_QUEUE_SHARE", "0.5"))
+
+# Logging de la API: nivel (con DEBUG se registra cada petición, con sus
+# cabeceras) y formato clave=valor
+LOG_LEVEL = os.getenv("RAG_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv(
+    "RAG_LOG_FORMAT", "ts=%(asctime)s level=%(levelname)s logger=%(name)s %(message)s"
+)
+
+# Trazas por petición (tracing.py): exportador "none", "json" (un span por
+# línea en TRACE_JSON_PATH) u "otlp" (OTLP/HTTP JSON a un collector), y
+# fracción de peticiones muestreadas. Un traceparent muestreado del cliente
+# se traza siempre.
+TRACE_EXPORTER = os.getenv("RAG_TRACE_EXPORTER", "none").lower()
+TRACE_SAMPLE_RATE = float(os.getenv("RAG_TRACE_SAMPLE_RATE", "0.01"))
+TRACE_JSON_PATH = os.getenv("RAG_TRACE_JSON_PATH", "./traces/spans.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv(
+    "RAG_TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces"
+)
@@ -0,0 +1,125 @@
+import re
+
+from llama_index.core.utils import get_tokenizer
+
+# Puntos donde se puede cortar un nodo sin partir una frase
+_CUT_POINTS = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+class ContextAssembler:
+    """Construye el prompt de /context dentro de un presupuesto de tokens.
+
+    El system prompt y el prompt del usuario se cuentan enteros; el resto del
+    presupuesto se llena con los textos recuperados en el orden recibido (ya
+    vienen de más a menos relevantes). Se quitan las líneas repetidas entre
+    nodos (las etiquetas de productos con el mismo principio activo se
+    repiten mucho), el nodo que no cabe entero se corta al final de una
+    frase y los que ya no caben se descartan.
+    """
+
+    def __init__(self, max_tokens=1536, min_chunk_tokens=24, tokenizer=None):
+        self.max_tokens = max_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self._tokenizer = tokenizer or get_tokenizer()
+        self.totals = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "retrieved_tokens": 0,
+            "context_tokens": 0,
+            "trimmed_tokens": 0,
+            "duplicate_lines": 0,
+            "dropped_nodes": 0,
+        }
+
+    def count(self, text: str) -> int:
+        return len(self._tokenizer(text))
+
+    def _dedup(self, text, seen):
+        """Quita las líneas ya vistas en nodos anteriores."""
+        lines, duplicates = [], 0
+        for line in text.splitlines():
+            key = " ".join(line.split()).casefold()
+            if key and key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            lines.append(line)
+        content = [line for line in lines if line.strip()]
+        # Solo queda la cabecera "<nombre> - <sección>:": no aporta nada
+        if duplicates and len(content) <= 1:
+            return "", duplicates
+        return "\n".join(lines), duplicates
+
+    def _truncate(self, text, budget):
+        """Prefijo más largo de text que acaba en frase y cabe en budget."""
+        cuts = [match.start() for match in _CUT_POINTS.finditer(text)]
+        best, low, high = "", 0, len(cuts) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = text[: cuts[middle]]
+            if self.count(candidate) <= budget:
+                best, low = candidate, middle + 1
+            else:
+                high = middle - 1
+        return best
+
+    def assemble(self, system_prompt: str, texts, prompt: str):
+        """Devuelve (prompt sin el system prompt, informe de tokens).
+
+        El system prompt se envía a Ollama por separado, pero cuenta para el
+        presupuesto y para ``prompt_tokens``.
+        """
+        system_tokens = self.count(system_prompt)
+        budget = max(0, self.max_tokens - system_tokens - self.count(prompt))
+        seen = set()
+        kept = []
+        used = retrieved = duplicates = dropped = 0
+
+        for text in texts:
+            tokens = self.count(text)
+            retrieved += tokens
+            text, removed = self._dedup(text, seen)
+            duplicates += removed
+            if removed:
+                tokens = self.count(text) if text else 0
+            if not text:
+                dropped += 1
+                continue
+
+            if used + tokens > budget:
+                remaining = budget - used
+                text = (
+                    self._truncate(text, remaining)
+                    if remaining >= self.min_chunk_tokens
+                    else ""
+                )
+                if not text:
+                    dropped += 1
+                    continue
+                tokens = self.count(text)
+            kept.append(text)
+            used += tokens
+
+        user_prompt = "\n\n".join(["\n".join(kept), prompt])
+        report = {
+            "prompt_tokens": system_tokens + self.count(user_prompt),
+            "retrieved_tokens": retrieved,
+            "context_tokens": used,
+            "trimmed_tokens": retrieved - used,
+            "duplicate_lines": duplicates,
+            "dropped_nodes": dropped,
+        }
+        self.totals["requests"] += 1
+        for key, value in report.items():
+            self.totals[key] += value
+        return user_prompt, report
+
+    def stats(self):
+        requests = self.totals["requests"]
+        return {
+            **self.totals,
+            "max_tokens": self.max_tokens,
+            "avg_prompt_tokens": round(self.totals["prompt_tokens"] / requests, 1)
+            if requests
+            else 0.0,
+        }
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import unicodedata
+from collections import deque
+
+from bm25 import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[\W_]+")
+# "Active ingredients (in each tablet) Ibuprofen 200 mg (NSAID)*" -> "Ibuprofen"
+_INGREDIENT_NOISE = re.compile(r"\([^)]*\)|active ingredients?|purposes?", re.IGNORECASE)
+_INGREDIENT_SPLIT = re.compile(r",|;|\band\b|\by\b|\bet\b|\d", re.IGNORECASE)
+_PLACEHOLDER_NAMES = {"", "unknown", "not specified"}
+MIN_PATTERN_LENGTH = 4
+# Palabras habituales en nombres de productos genéricos ("Pain Relief Extra
+# Strength", "Cold and Flu Relief", "Night Time", "Hand Sanitizer") y en
+# preguntas normales. Un nombre hecho solo de estas palabras no identifica
+# ningún medicamento y no se usa como patrón.
+COMMON_WORDS = STOPWORDS | frozenset(
+    """
+    adult adults advanced aid alcohol all allergy and antacid antibacterial
+    anti antiseptic baby back body care chest children childrens cold comfort
+    cough day daytime dolor drops dry extra eye eyes face fast fever flu
+    formula gel gentle hand hands head headache health heartburn hot instant itch
+    junior kids liquid lotion max maximum medicine menstrual mint multi
+    muscle nasal natural night nighttime non original pain plus pm rapid
+    regular relief relieve rub sanitizer severe sinus skin sleep soap sore
+    spray strength sugar tablet tablets throat time ultra up vapor water
+    wipes with women
+    """.split()
+)
+
+
+def is_specific_name(name: str) -> bool:
+    """Si el nombre tiene alguna palabra propia (no genérica ni número)."""
+    return any(
+        word not in COMMON_WORDS and not word.isdigit()
+        for word in match_text(name).split()
+    )
+
+
+def match_text(text: str) -> str:
+    """Texto comparable: sin acentos ni mayúsculas, palabras separadas por un
+    espacio y con un espacio en cada extremo (así los límites de palabra son
+    parte del patrón)."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return f" {_NON_WORD.sub(' ', text).strip()} "
+
+
+def ingredient_names(active_ingredient: str):
+    """Nombres de principios activos de la sección active_ingredient."""
+    text = _INGREDIENT_NOISE.sub(" ", active_ingredient)
+    for part in _INGREDIENT_SPLIT.split(text):
+        name = part.strip(" .:*-")
+        # Solo nombres de una palabra: "each tablet contains" no es un principio activo
+        if len(name) >= MIN_PATTERN_LENGTH and " " not in name:
+            yield name
+
+
+class _Automaton:
+    """Trie con enlaces de fallo; se construye entero antes de usarse."""
+
+    def __init__(self, max_drugs_per_ingredient):
+        self.max_drugs_per_ingredient = max_drugs_per_ingredient
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # estado -> índices de patrones que terminan en él
+        self.patterns = []  # (drug_keys, es_marca)
+        self.pattern_ids = {}
+
+    def add(self, text, drug_key, brand):
+        pattern = match_text(text)
+        if len(pattern.strip()) < MIN_PATTERN_LENGTH or pattern.strip() in _PLACEHOLDER_NAMES:
+            return
+        if pattern in self.pattern_ids:
+            keys, is_brand = self.patterns[self.pattern_ids[pattern]]
+            if drug_key in keys or (is_brand and not brand):
+                return
+            if brand or len(keys) < self.max_drugs_per_ingredient:
+                keys.append(drug_key)
+            return
+
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.pattern_ids[pattern] = len(self.patterns)
+        self.output[state].append(len(self.patterns))
+        self.patterns.append(([drug_key], brand))
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                target = self.goto[fail].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+        return self
+
+    def search(self, text):
+        """(drug_keys, es_marca) de cada patrón encontrado, en una pasada."""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern in output[state]:
+                yield self.patterns[pattern]
+
+
+class DrugNameMatcher:
+    """Autómata de Aho–Corasick con los nombres de todos los medicamentos.
+
+    Los patrones salen de la tabla labels de medications.db: nombre comercial,
+    name_es, name_fr y los principios activos. Los nombres hechos solo de
+    palabras comunes (``COMMON_WORDS``) y los que comparten más de
+    ``max_labels_per_name`` productos no son patrones: coincidirían con
+    preguntas normales. ``find`` recorre el prompt una sola vez (tiempo
+    lineal, da igual cuántos nombres haya) y devuelve los drug_key
+    mencionados, primero las marcas y después los principios activos, de los
+    que solo se guardan ``max_drugs_per_ingredient`` productos.
+    """
+
+    def __init__(self, db_path, max_drugs_per_ingredient=3, max_labels_per_name=5):
+        self.db_path = db_path
+        self.max_drugs_per_ingredient = max_drugs_per_ingredient
+        self.max_labels_per_name = max_labels_per_name
+        self.lookups = 0
+        self.hits = 0
+        self._mtime = None
+        self._automaton = _Automaton(max_drugs_per_ingredient).build()
+
+    def load(self):
+        """Construye el autómata desde la tabla labels. Devuelve nº de patrones."""
+        automaton = _Automaton(self.max_drugs_per_ingredient)
+        mtime = None
+        rows = []
+        if os.path.exists(self.db_path):
+            mtime = os.stat(self.db_path).st_mtime
+            db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            try:
+                rows = db.execute(
+                    "SELECT key, name, name_es, name_fr, active_ingredient FROM labels"
+                ).fetchall()
+            except sqlite3.OperationalError:
+                pass  # Base de datos sin tabla labels todavía
+            finally:
+                db.close()
+
+        # Un nombre que llevan muchos productos es genérico, aunque sea raro
+        brands = {}  # patrón -> drug_keys (en orden)
+        for key, *names, _ in rows:
+            for name in names:
+                if name and is_specific_name(name):
+                    brands.setdefault(match_text(name), {})[key] = None
+        for pattern, keys in brands.items():
+            if len(keys) <= self.max_labels_per_name:
+                for key in keys:
+                    automaton.add(pattern, key, brand=True)
+        # Después, con menos prioridad, los principios activos. Si coinciden
+        # con una marca, gana la marca.
+        for key, *_, active_ingredient in rows:
+            for name in ingredient_names(active_ingredient or ""):
+                if is_specific_name(name):
+                    automaton.add(name, key, brand=False)
+
+        # Se sustituye de una vez: find() nunca ve un autómata a medias
+        self._automaton = automaton.build()
+        self._mtime = mtime
+        return len(automaton.patterns)
+
+    async def watch(self, interval=30.0):
+        """Reconstruye el autómata cuando cambia medications.db."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.db_path).st_mtime
+            except OSError:
+                continue
+            if mtime != self._mtime:
+                count = await asyncio.to_thread(self.load)
+                logger.info("♻️ Drug name index rebuilt names=%d", count)
+
+    def find(self, prompt: str, limit=3):
+        """drug_key de los medicamentos mencionados en el prompt (máx. limit)."""
+        self.lookups += 1
+        brands, generics = [], []
+        for keys, brand in self._automaton.search(match_text(prompt)):
+            (brands if brand else generics).extend(keys)
+
+        found = list(dict.fromkeys(brands + generics))[:limit]
+        if found:
+            self.hits += 1
+        return found
+
+    def stats(self):
+        return {
+            "names": len(self._automaton.patterns),
+            "lookups": self.lookups,
+            "hits": self.hits,
+        }
@@ -0,0 +1,129 @@
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = "¿?¡!.,;:\"' "
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Clave de caché: sin mayúsculas, espacios repetidos ni signos en los extremos."""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    return _SPACES.sub(" ", text).strip(_EDGE_PUNCTUATION)
+
+
+class EmbeddingCache:
+    """LRU acotada con TTL de prompt normalizado -> vector de embedding.
+
+    Es segura entre hilos (la usan los workers de retrieval) y, si se le da
+    una ruta, se guarda en disco al apagar y se recarga al arrancar.
+    """
+
+    def __init__(self, max_size=4096, ttl=86400, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.labels(cache="embedding", result="miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.labels(cache="embedding", result="hit").inc()
+            return entry[0]
+
+    def put(self, key, vector):
+        with self._lock:
+            self._entries[key] = (vector, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, "rb") as f:
+                entries = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning("⚠️ Could not load embedding cache path=%s error=%s", self.path, e)
+            return 0
+
+        now = time.time()
+        with self._lock:
+            for key, (vector, created) in entries:
+                if now - created <= self.ttl:
+                    self._entries[key] = (vector, created)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return len(self._entries)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = list(self._entries.items())
+        # Escritura atómica: nunca queda un fichero a medias
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+
+class CachedEmbedding:
+    """Envuelve Settings.embed_model consultando antes la EmbeddingCache."""
+
+    def __init__(self, embed_model, cache: EmbeddingCache):
+        self.embed_model = embed_model
+        self.cache = cache
+
+    def get_text_embedding_batch(self, texts):
+        keys = [normalize_prompt(text) for text in texts]
+        vectors = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self.cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+
+        if missing:
+            embedded = self.embed_model.get_text_embedding_batch(list(missing.values()))
+            for key, vector in zip(missing, embedded):
+                self.cache.put(key, vector)
+                vectors[key] = vector
+
+        return [vectors[key] for key in keys]
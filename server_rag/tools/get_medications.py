@@ -1,13 +1,96 @@
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    FIRST_COMPLETED,
+    wait,
+)
+import argparse
 import os
 import json
+import random
+import threading
 import time
 import re
+import hashlib
+from string import Formatter
+from medication_store import MedicationStore, NameIndex, LabelStore, iter_records
 
 BASE_URL = "https://api.fda.gov/drug/label.json"
 OUTPUT_DIR = "docs"
 OUTPUT_DIR_JSON = "json_docs"
 MAX_RESULTS = 1000
+# Cuota de OpenFDA: 240 peticiones por minuto (con o sin API key)
+REQUESTS_PER_MINUTE = 240
+CONCURRENCY = 4
+MAX_RETRIES = 6
+MEDICATIONS_JSONL = os.path.join(OUTPUT_DIR_JSON, "medications.jsonl")
+LEGACY_MEDICATIONS_JSON = os.path.join(OUTPUT_DIR_JSON, "medications.json")
+NAMES_DB = os.path.join(OUTPUT_DIR_JSON, "medications.db")
+RENDER_WORKERS = os.cpu_count() or 1
+RENDER_CHUNK = 256
+
+# Plantilla común a fetch y write_from_json, troceada una sola vez en
+# (literal, campo) para no volver a parsearla por cada medicamento.
+MARKDOWN_TEMPLATE = """# Name of the Medicine
+{name_block}
+
+## Manufacturer
+{manufacturer}
+
+## Active Ingredient
+{active_ingredient}
+
+## Purpose
+{purpose}
+
+## Description
+{description}
+
+## Indications
+- {indications}
+
+## Warnings
+- {warnings}
+
+## Do Not Use
+- {contraindications}
+
+## When Using
+- {when_using}
+
+## Stop Use
+- {stop_use}
+
+## Keep Out of Reach of Children
+- {keep_out}
+
+## Side Effects
+- {side_effects}
+
+## Dosage Recommendations
+{dosage}
+
+## Storage and Handling
+{storage}
+
+## Inactive Ingredients
+{inactive_ingredients}
+
+## Questions or Comments
+{questions}
+"""
+_TEMPLATE_PARTS = [
+    (literal, field) for literal, field, _, _ in Formatter().parse(MARKDOWN_TEMPLATE)
+]
+
+
+def render_markdown(fields):
+    return "".join(
+        literal + (str(fields[field]) if field else "")
+        for literal, field in _TEMPLATE_PARTS
+    )
 
 
 def clean_text(text):
@@ -48,6 +131,7 @@ def format_markdown(entry):
 
     data_json = {
         "name": name,
+        "set_id": entry.get("set_id", ""),
         "manufacturer": manufacturer,
         "active_ingredient": active_ingredient,
         "purpose": purpose,
@@ -65,54 +149,7 @@ def format_markdown(entry):
         "questions": questions,
     }
 
-    text = f"""# Name of the Medicine
-{name}
-
-## Manufacturer
-{manufacturer}
-
-## Active Ingredient
-{active_ingredient}
-
-## Purpose
-{purpose}
-
-## Description
-{description}
-
-## Indications
-- {indications}
-
-## Warnings
-- {warnings}
-
-## Do Not Use
-- {contraindications}
-
-## When Using
-- {when_using}
-
-## Stop Use
-- {stop_use}
-
-## Keep Out of Reach of Children
-- {keep_out}
-
-## Side Effects
-- {side_effects}
-
-## Dosage Recommendations
-{dosage}
-
-## Storage and Handling
-{storage}
-
-## Inactive Ingredients
-{inactive_ingredients}
-
-## Questions or Comments
-{questions}
-"""
+    text = render_markdown({**data_json, "name_block": name})
 
     return {"text": text, "json": data_json}
 
@@ -122,175 +159,372 @@ def sanitize_filename(name: str) -> str:
     return re.sub(r"[^a-zA-Z0-9_\-]", "_", name.strip())
 
 
-def fetch_medicines():
-    print("Fetching data from OpenFDA...")
-
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    os.makedirs(OUTPUT_DIR_JSON, exist_ok=True)
-
-    # Skip anterior
-    skip = 0
-    names = set()
-    skip_file = os.path.join(OUTPUT_DIR_JSON, "skip.json")
-
-    if os.path.exists(skip_file):
-        with open(skip_file, "r", encoding="utf-8") as f:
-            skip_data = json.load(f)
-            skip = skip_data.get("skip", 0)
-    else:
+class TokenBucket:
+    """Limitador de peticiones compartido entre hilos."""
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def write_json_atomic(path, data):
+    """Escribe en un temporal y lo renombra: nunca queda un JSON a medias."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_skip_state(skip_file):
+    """Devuelve (primer skip pendiente, skips ya completados por encima)."""
+    if not os.path.exists(skip_file):
         print("No skip file found, starting from the beginning.")
+        return 0, set()
+    with open(skip_file, "r", encoding="utf-8") as f:
+        skip_data = json.load(f)
+    return skip_data.get("skip", 0), set(skip_data.get("done", []))
 
-    existing_files = {
-        f.replace(".md", "").replace("_", " ").replace("-", "/").lower()
-        for f in os.listdir(OUTPUT_DIR)
-        if f.endswith(".md")
-    }
 
-    medications_dict = {}
-    numErrors = 0
+def fetch_page(session, base_url, skip, limiter, api_key=None):
+    """Una página de OpenFDA; reintenta con backoff exponencial solo si falla."""
+    params = {"limit": MAX_RESULTS, "skip": skip}
+    if api_key:
+        params["api_key"] = api_key
 
-    while True:
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
         try:
-            print(f"Fetching medications with skip={skip}...")
-            time.sleep(1 * (numErrors + 1))
-            params = {"limit": MAX_RESULTS, "skip": skip}
-
-            response = requests.get(BASE_URL, params=params)
+            response = session.get(base_url, params=params, timeout=60)
+            # OpenFDA responde 404 cuando el skip supera el total
+            if response.status_code == 404:
+                return {"results": []}
             response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(60, 2**attempt) + random.uniform(0, 1)
+            print(f"Error fetching skip={skip}: {e}. Retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def legacy_filenames(name):
+    """Nombres de fichero que usaban fetch y write_from_json antes del índice."""
+    return [
+        f"{sanitize_filename(name)}.md",
+        f"{name.replace(' ', '_').replace('/', '-')}.md",
+    ]
+
+
+def open_name_index():
+    return NameIndex(NAMES_DB).open(
+        seed_records=read_medications(),
+        seed_dir=OUTPUT_DIR,
+        candidates=legacy_filenames,
+    )
 
-            results = response.json().get("results", [])
-            if not results:
-                print("No more medications found.")
-                break
-
-            for entry in results:
-                markdown = format_markdown(entry)
-                name = entry.get("openfda", {}).get("brand_name", ["Not Recognized"])[0]
-                if name == "Not Recognized":
-                    continue
-
-                name_lower = name.lower()
-                if (
-                    name_lower in names
-                    or name_lower in existing_files
-                    or name in medications_dict
-                ):
-                    print(f"Skipping duplicate or existing name: {name}")
-                    continue
-
-                safe_name = sanitize_filename(name)
-                md_filename = os.path.join(OUTPUT_DIR, f"{safe_name}.md")
-
-                if os.path.exists(md_filename):
-                    print(f"File already exists for {name}: {md_filename}")
-                    continue
-
-                # Guardar markdown
-                with open(md_filename, "w", encoding="utf-8") as f:
-                    f.write(markdown["text"])
-
-                medications_dict[name] = markdown["json"]
-                names.add(name_lower)
-
-        except Exception as e:
-            if numErrors > 5:
-                print("Too many errors, stopping the process.")
-                break
-            print(f"Error processing entry: {e}")
-            numErrors += 1
-            continue
-
-        skip += MAX_RESULTS
-        with open(skip_file, "w", encoding="utf-8") as f:
-            json.dump({"skip": skip}, f)
-
-        print(f"Batch completed. Total new written: {len(names)}")
-
-    if not medications_dict:
-        print("No new medications were written. Exiting.")
-        return
-
-    # Guardar el archivo final
-    with open(f"{OUTPUT_DIR_JSON}/medications.json", "w", encoding="utf-8") as f:
-        json.dump(medications_dict, f, indent=4, ensure_ascii=False)
 
-    print(f"✅ Finalizado. Total de medicamentos guardados: {len(medications_dict)}")
+def fetch_medicines(
+    base_url=BASE_URL,
+    concurrency=CONCURRENCY,
+    requests_per_minute=REQUESTS_PER_MINUTE,
+    api_key=None,
+    write_markdown=False,
+):
+    print("Fetching data from OpenFDA...")
 
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR_JSON, exist_ok=True)
 
-def write_from_json():
-    medications_file = f"{OUTPUT_DIR_JSON}/medications.json"
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-    if not os.path.exists(medications_file):
-        print(f"File {medications_file} does not exist.")
+    # Skip anterior: "skip" es la primera página sin terminar y "done" las
+    # páginas posteriores ya terminadas (las páginas acaban en desorden).
+    skip_file = os.path.join(OUTPUT_DIR_JSON, "skip.json")
+    skip, done = load_skip_state(skip_file)
+
+    # Índice de nombres ya guardados: deduplicar es una búsqueda en memoria,
+    # sin listar docs/ ni comprobar ficheros.
+    name_index = open_name_index()
+
+    # Cada medicamento se añade al JSONL en cuanto se descarga
+    store = MedicationStore(MEDICATIONS_JSONL).open()
+    # Fuente del índice: una fila por medicamento, una columna por sección
+    labels = LabelStore(NAMES_DB).open(connection=name_index.connection)
+    written = 0
+
+    def save_entries(results):
+        nonlocal written
+        for entry in results:
+            name = entry.get("openfda", {}).get("brand_name", ["Not Recognized"])[0]
+            if name == "Not Recognized":
+                continue
+
+            set_id = entry.get("set_id")
+            if name_index.seen(name, set_id):
+                print(f"Skipping duplicate or existing name: {name}")
+                continue
+
+            markdown = format_markdown(entry)
+            store.append(markdown["json"])
+            labels.upsert(markdown["json"])
+
+            filename = None
+            if write_markdown:
+                filename = name_index.reserve_filename(sanitize_filename(name))
+                write_atomic(os.path.join(OUTPUT_DIR, filename), markdown["text"])
+                name_index.set_rendered(filename, record_hash(markdown["json"]))
+            name_index.add(name, set_id, filename)
+            written += 1
+        labels.commit()
+        name_index.commit()
+
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=concurrency))
+    session.mount("http://", HTTPAdapter(pool_maxsize=concurrency))
+    limiter = TokenBucket(requests_per_minute / 60, capacity=concurrency)
+
+    next_skip = skip
+    total = None
+    in_flight = {}
+    stopped = False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def schedule():
+            nonlocal next_skip
+            while not stopped and len(in_flight) < concurrency and (total is None or next_skip < total):
+                if next_skip not in done:
+                    future = executor.submit(
+                        fetch_page, session, base_url, next_skip, limiter, api_key
+                    )
+                    in_flight[future] = next_skip
+                next_skip += MAX_RESULTS
+                # Hasta conocer el total solo se pide una página
+                if total is None:
+                    break
+
+        schedule()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                page_skip = in_flight.pop(future)
+                try:
+                    data = future.result()
+                except requests.RequestException as e:
+                    # Lo ya escrito se conserva; la próxima ejecución sigue aquí
+                    print(f"Too many errors on skip={page_skip}, stopping: {e}")
+                    stopped = True
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    in_flight.clear()
+                    break
+
+                results = data.get("results", [])
+                if total is None:
+                    total = data.get("meta", {}).get("results", {}).get("total", 0)
+                    print(f"OpenFDA reports {total} labels.")
+                save_entries(results)
+
+                # Página terminada: avanzar la marca y guardar el estado
+                done.add(page_skip)
+                while skip in done:
+                    done.discard(skip)
+                    skip += MAX_RESULTS
+                write_json_atomic(skip_file, {"skip": skip, "done": sorted(done)})
+                print(
+                    f"Page skip={page_skip} completed. Total new written: {written}"
+                )
+            schedule()
+
+    store.close()
+    labels.close()
+    name_index.close()
+    if not written:
+        print("No new medications were written. Exiting.")
         return
 
-    with open(medications_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    for item in data:
-        name = item.get("name", "Unknown")
-        name_es = item.get("name_es", "Unknown")
-        name_fr = item.get("name_fr", "Unknown")
-        md_filename = f"{OUTPUT_DIR}/{name.replace(' ', '_').replace('/', '-')}.md"
-        if os.path.exists(md_filename):
-            continue
-        with open(md_filename, "w", encoding="utf-8") as f:
-            text = f"""# Name of the Medicine
-en: {name}
-es: {name_es}
-fr: {name_fr}
-
-## Manufacturer
-{item["manufacturer"]}
-
-## Active Ingredient
-{item["active_ingredient"]}
+    print(f"✅ Finalizado. Total de medicamentos guardados: {written}")
 
-## Purpose
-{item["purpose"]}
-
-## Description
-{item["description"]}
 
-## Indications
-- {item["indications"]}
-
-## Warnings
-- {item["warnings"]}
+def read_medications():
+    """Registros de medications.jsonl en streaming (o del medications.json antiguo)."""
+    if os.path.exists(MEDICATIONS_JSONL):
+        yield from iter_records(MEDICATIONS_JSONL)
+        return
 
-## Do Not Use
-- {item["contraindications"]}
+    if os.path.exists(LEGACY_MEDICATIONS_JSON):
+        # Formato antiguo: un único JSON (lista o nombre -> registro) en memoria
+        with open(LEGACY_MEDICATIONS_JSON, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        yield from data.values() if isinstance(data, dict) else data
+        return
 
-## When Using
-- {item["when_using"]}
+    print(f"File {MEDICATIONS_JSONL} does not exist.")
 
-## Stop Use
-- {item["stop_use"]}
 
-## Keep Out of Reach of Children
-- {item["keep_out"]}
+def build_labels():
+    """Rellena la tabla labels desde los registros ya descargados."""
+    os.makedirs(OUTPUT_DIR_JSON, exist_ok=True)
+    count = 0
+    with LabelStore(NAMES_DB) as labels:
+        for item in read_medications():
+            labels.upsert(item)
+            count += 1
+    print(f"✅ {count} medications stored in {NAMES_DB} (labels table).")
 
-## Side Effects
-- {item["side_effects"]}
 
-## Dosage Recommendations
-{item["dosage"]}
+def write_atomic(path, text):
+    """Escribe en un temporal del mismo directorio y lo renombra."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
 
-## Storage and Handling
-{item["storage"]}
 
-## Inactive Ingredients
-{item["inactive_ingredients"]}
+def record_hash(record):
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
 
-## Questions or Comments
-{item["questions"]}
-"""
-            f.write(text)
 
-    print(f"All medications have been written to {OUTPUT_DIR}.")
+def render_chunk(output_dir, items):
+    """Renderiza y escribe un trozo de registros en un proceso del pool."""
+    for filename, item in items:
+        name = item.get("name", "Unknown")
+        name_block = (
+            f"en: {name}\n"
+            f"es: {item.get('name_es', 'Unknown')}\n"
+            f"fr: {item.get('name_fr', 'Unknown')}"
+        )
+        write_atomic(
+            os.path.join(output_dir, filename),
+            render_markdown({**item, "name_block": name_block}),
+        )
+    return len(items)
+
+
+def write_from_json(force=False, workers=RENDER_WORKERS, chunk_size=RENDER_CHUNK):
+    """Genera docs/ desde los registros guardados.
+
+    Por defecto solo reescribe los medicamentos cuyo registro cambió desde el
+    último render (según el hash guardado en medications.db); con force=True
+    los reescribe todos.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR_JSON, exist_ok=True)
+    started = time.perf_counter()
+
+    name_index = open_name_index()
+    rendered = skipped = 0
+    chunk = []
+    hashes = []
+    pending = []
+
+    def collect(future, chunk_hashes):
+        nonlocal rendered
+        rendered += future.result()
+        for filename, digest in chunk_hashes:
+            name_index.set_rendered(filename, digest)
+        name_index.commit()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for item in read_medications():
+            name = item.get("name", "Unknown")
+            filename = name_index.filename_for(name)
+            if filename is None:
+                filename = name_index.reserve_filename(sanitize_filename(name))
+                name_index.add(name, item.get("set_id"), filename)
+
+            digest = record_hash(item)
+            if not force and name_index.rendered_hash(filename) == digest:
+                skipped += 1
+                continue
+
+            chunk.append((filename, item))
+            hashes.append((filename, digest))
+            if len(chunk) >= chunk_size:
+                pending.append((executor.submit(render_chunk, OUTPUT_DIR, chunk), hashes))
+                chunk, hashes = [], []
+                # Como mucho dos trozos en cola por proceso: memoria acotada
+                while len(pending) >= workers * 2:
+                    collect(*pending.pop(0))
+
+        if chunk:
+            pending.append((executor.submit(render_chunk, OUTPUT_DIR, chunk), hashes))
+        for future, chunk_hashes in pending:
+            collect(future, chunk_hashes)
+
+    name_index.close()
+    print(
+        f"All medications have been written to {OUTPUT_DIR}: {rendered} rendered, "
+        f"{skipped} unchanged in {time.perf_counter() - started:.2f}s."
+    )
 
 
 if __name__ == "__main__":
-    # fetch_medicines()
-    write_from_json()
+    parser = argparse.ArgumentParser(description="Descarga etiquetas de OpenFDA")
+    subparsers = parser.add_subparsers(dest="command")
+    fetch = subparsers.add_parser("fetch", help="Descarga etiquetas de OpenFDA")
+    fetch.add_argument("--base-url", default=BASE_URL)
+    fetch.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    fetch.add_argument(
+        "--rate",
+        type=float,
+        default=REQUESTS_PER_MINUTE,
+        help="Peticiones por minuto",
+    )
+    fetch.add_argument("--api-key", default=os.getenv("OPENFDA_API_KEY"))
+    fetch.add_argument(
+        "--markdown",
+        action="store_true",
+        help="Escribe también un .md por medicamento en docs/",
+    )
+    subparsers.add_parser(
+        "labels", help="Rellena la tabla labels desde medications.jsonl"
+    )
+    write = subparsers.add_parser(
+        "write", help="Genera los markdown desde medications.jsonl"
+    )
+    mode = write.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--force", action="store_true", help="Reescribe todos los markdown"
+    )
+    mode.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="Solo los registros que cambiaron (por defecto)",
+    )
+    write.add_argument("--workers", type=int, default=RENDER_WORKERS)
+    write.add_argument("--chunk-size", type=int, default=RENDER_CHUNK)
+    args = parser.parse_args()
+
+    if args.command == "fetch":
+        fetch_medicines(
+            base_url=args.base_url,
+            concurrency=args.concurrency,
+            requests_per_minute=args.rate,
+            api_key=args.api_key,
+            write_markdown=args.markdown,
+        )
+    elif args.command == "labels":
+        build_labels()
+    elif args.command == "write":
+        write_from_json(
+            force=args.force, workers=args.workers, chunk_size=args.chunk_size
+        )
+    else:
+        write_from_json()
@@ -1,25 +1,382 @@
 # tools/index_documents.py
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core.storage.storage_context import StorageContext
 import chromadb
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from bm25 import BM25Index
+from medication_store import LabelStore
+from section_parser import MedicationSectionParser
 
-documents = SimpleDirectoryReader("./docs").load_data()
-embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
+DOCS_DIR = "./docs"
+LABELS_DB = "./json_docs/medications.db"
+STORAGE_DIR = "./storage"
+COLLECTION = "rag"
+# Ruta relativa en docs (o labels/<key>) -> hash del contenido y node_ids,
+# una fila por fichero
+MANIFEST_PATH = os.path.join(STORAGE_DIR, "index_manifest.db")
+# Manifiesto JSON de versiones anteriores: se migra una vez a MANIFEST_PATH
+LEGACY_MANIFEST_PATH = os.path.join(STORAGE_DIR, "index_manifest.json")
+INDEX_VERSION_PATH = os.path.join(STORAGE_DIR, "index_version")
+# Índice léxico BM25 con los mismos ids que la colección
+BM25_PATH = os.path.join(STORAGE_DIR, "bm25.db")
+DELETE_BATCH = 5000
+# Se añade a cada hash: cambiarlo al cambiar el troceado reindexa todo
+CHUNKING_VERSION = "sections-1"
 
-print(f"Loaded {len(documents)} documents.")
-chroma_client = chromadb.PersistentClient(path="./storage")
-vector_store = ChromaVectorStore(
-    chroma_collection=chroma_client.get_or_create_collection("rag")
-)
+_splitter = None
+_section_parser = None
 
-print("Creating vector store index...")
-storage_context = StorageContext.from_defaults(vector_store=vector_store)
-index = VectorStoreIndex.from_documents(
-    documents, storage_context=storage_context, embed_model=embed_model
-)
-print("Index created successfully.")
 
-print("Persisting index to storage...")
-index.storage_context.persist()
+def chunk_job(rel, source):
+    """Trocea un fichero (ruta) o una fila de labels (dict) en un proceso del pool.
+
+    Los medicamentos (filas de labels o markdown de get_medications.py) dan
+    un nodo por sección; el resto de documentos pasa por el SentenceSplitter.
+    Devuelve ids deterministas (origen + posición), textos y metadatos ya en
+    el formato de ChromaVectorStore, para que el proceso principal solo tenga
+    que embeber y hacer upsert.
+    """
+    global _splitter, _section_parser
+    if _splitter is None:
+        _splitter = SentenceSplitter()
+        _section_parser = MedicationSectionParser()
+
+    if isinstance(source, dict):
+        nodes = _section_parser.from_label_row(source)
+    else:
+        nodes = None
+        if source.endswith(".md"):
+            with open(source, "r", encoding="utf-8") as f:
+                text = f.read()
+            if _section_parser.is_medication_markdown(text):
+                file_metadata = {
+                    "file_path": source,
+                    "file_name": os.path.basename(source),
+                }
+                nodes = _section_parser.from_markdown(text, file_metadata)
+        if nodes is None:
+            documents = SimpleDirectoryReader(
+                input_files=[source], filename_as_id=True
+            ).load_data()
+            nodes = _splitter.get_nodes_from_documents(documents)
+
+    ids, texts, metadatas = [], [], []
+    for i, node in enumerate(nodes):
+        # Si una ejecución se corta antes de guardar el manifiesto, la
+        # siguiente sobreescribe estos mismos ids en vez de duplicar.
+        node.id_ = f"{rel}::{i}"
+        ids.append(node.node_id)
+        texts.append(node.get_content())
+        metadatas.append(node_to_metadata_dict(node, remove_text=True, flat_metadata=True))
+    return rel, ids, texts, metadatas
+
+
+def bounded_map(executor, fn, items, max_in_flight):
+    """Como executor.map pero sin encolar más de max_in_flight tareas a la vez."""
+    pending = []
+    for item in items:
+        pending.append(executor.submit(fn, *item))
+        if len(pending) >= max_in_flight:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_docs(docs_dir):
+    """Ruta relativa -> ruta absoluta de cada fichero en docs."""
+    files = {}
+    for root, _, names in os.walk(docs_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, docs_dir).replace(os.sep, "/")] = path
+    return files
+
+
+def is_medication_file(path):
+    """Markdown de medicamento escrito por get_medications.py."""
+    if not path.endswith(".md"):
+        return False
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        head = f.read(4096)
+    return MedicationSectionParser.is_medication_markdown(head)
+
+
+def open_manifest():
+    """Conexión al manifiesto y su contenido (None si está vacío).
+
+    Es SQLite para que cada flush escriba solo las filas de lo recién
+    indexado: reescribir un JSON entero por batch hace la indexación O(n²).
+    """
+    is_new = not os.path.exists(MANIFEST_PATH)
+    db = sqlite3.connect(MANIFEST_PATH)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS files (
+            rel TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            node_ids TEXT NOT NULL
+        )"""
+    )
+    if is_new and os.path.exists(LEGACY_MANIFEST_PATH):
+        with open(LEGACY_MANIFEST_PATH, "r", encoding="utf-8") as f:
+            save_manifest(db, json.load(f))
+        os.remove(LEGACY_MANIFEST_PATH)
+
+    manifest = {
+        rel: {"hash": digest, "node_ids": json.loads(node_ids)}
+        for rel, digest, node_ids in db.execute("SELECT rel, hash, node_ids FROM files")
+    }
+    return db, manifest or None
+
+
+def save_manifest(db, entries):
+    """Añade o reemplaza las entradas {rel: {"hash", "node_ids"}} dadas."""
+    db.executemany(
+        "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+        (
+            (rel, entry["hash"], json.dumps(entry["node_ids"]))
+            for rel, entry in entries.items()
+        ),
+    )
+    db.commit()
+
+
+def remove_from_manifest(db, rels):
+    db.executemany("DELETE FROM files WHERE rel = ?", ((rel,) for rel in rels))
+    db.commit()
+
+
+def delete_vectors(collection, node_ids):
+    for i in range(0, len(node_ids), DELETE_BATCH):
+        collection.delete(ids=node_ids[i : i + DELETE_BATCH])
+
+
+def backfill_bm25(collection, bm25, page_size=5000):
+    """Rellena el BM25 con los textos que ya están en Chroma (sin reembeber)."""
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["documents"])
+        if not page["ids"]:
+            break
+        bm25.add(page["ids"], page["documents"])
+        offset += len(page["ids"])
+    bm25.commit()
+    return offset
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Indexa ./docs en la colección Chroma 'rag' de forma incremental."
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Borra la colección y reindexa todo"
+    )
+    parser.add_argument(
+        "--labels",
+        default=LABELS_DB,
+        help="medications.db con la tabla labels ('' para no indexarla)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Procesos para leer y trocear documentos",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=512,
+        help="Chunks por llamada al modelo de embeddings",
+    )
+    parser.add_argument(
+        "--upsert-size",
+        type=int,
+        default=4096,
+        help="Vectores por upsert en Chroma",
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    chroma_client = chromadb.PersistentClient(path=STORAGE_DIR)
+    collection = chroma_client.get_or_create_collection(COLLECTION)
+
+    manifest_db, manifest = open_manifest()
+    if args.full:
+        manifest = None
+    if manifest is None:
+        # Sin manifiesto no se sabe qué vectores vienen de qué fichero:
+        # se reconstruye desde cero para no duplicar.
+        if collection.count():
+            print("No manifest found, rebuilding the collection from scratch.")
+        chroma_client.delete_collection(COLLECTION)
+        collection = chroma_client.get_or_create_collection(COLLECTION)
+        manifest_db.execute("DELETE FROM files")
+        manifest_db.commit()
+        manifest = {}
+
+    bm25 = BM25Index(BM25_PATH).open()
+    if not manifest:
+        bm25.clear()
+    elif not bm25.count() and collection.count():
+        # Colección indexada antes de existir el BM25
+        print(f"BM25 index missing, backfilled {backfill_bm25(collection, bm25)} nodes.")
+
+    # 1. Detectar cambios por hash de contenido. Las filas de labels usan su
+    # row_hash, así que no hace falta leer su texto para saber si cambiaron.
+    files = scan_docs(DOCS_DIR)
+    labels = None
+    if args.labels and os.path.exists(args.labels):
+        # Solo lectura: medications.db también existe sin tabla labels (la
+        # crea "get_medications.py write" para names y rendered)
+        labels = LabelStore(args.labels).open(readonly=True)
+        if not labels.has_rows():
+            labels.close()
+            labels = None
+    if labels is not None:
+        # La tabla labels sustituye al markdown de medicamentos: indexar los
+        # dos duplicaría cada sección. Los que ya estaban en el manifiesto
+        # quedan como eliminados y se borran de Chroma y del BM25.
+        files = {
+            rel: path for rel, path in files.items() if not is_medication_file(path)
+        }
+    hashes = {
+        rel: f"{CHUNKING_VERSION}:{file_hash(path)}" for rel, path in files.items()
+    }
+    if labels is not None:
+        for key, row_hash in labels.hashes().items():
+            files[f"labels/{key}"] = None
+            hashes[f"labels/{key}"] = f"{CHUNKING_VERSION}:{row_hash}"
+    added = [rel for rel in files if rel not in manifest]
+    updated = [
+        rel for rel in files if rel in manifest and manifest[rel]["hash"] != hashes[rel]
+    ]
+    removed = [rel for rel in manifest if rel not in files]
+    skipped = len(files) - len(added) - len(updated)
+    scanned = time.perf_counter()
+
+    # 2. Borrar vectores de ficheros eliminados o modificados
+    stale_ids = [
+        node_id for rel in removed + updated for node_id in manifest[rel]["node_ids"]
+    ]
+    delete_vectors(collection, stale_ids)
+    bm25.remove(stale_ids)
+    bm25.commit()
+    for rel in removed:
+        del manifest[rel]
+    remove_from_manifest(manifest_db, removed)
+    deleted = time.perf_counter()
+
+    # 3. Trocear en paralelo y embeber en batches grandes solo lo nuevo o
+    # modificado. La memoria queda acotada por --batch-size, no por el corpus.
+    to_index = added + updated
+    chunks = 0
+    indexed = 0
+    if to_index:
+        embed_model = HuggingFaceEmbedding(
+            model_name="sentence-transformers/all-MiniLM-L6-v2",
+            embed_batch_size=args.batch_size,
+        )
+        upsert_size = min(args.upsert_size, chroma_client.get_max_batch_size())
+        buffer = {"ids": [], "documents": [], "metadatas": []}
+        buffered_files = {}
+
+        def flush():
+            nonlocal chunks, indexed
+            if not buffer["ids"]:
+                return
+            embeddings = embed_model.get_text_embedding_batch(buffer["documents"])
+            for i in range(0, len(embeddings), upsert_size):
+                collection.upsert(
+                    ids=buffer["ids"][i : i + upsert_size],
+                    embeddings=embeddings[i : i + upsert_size],
+                    documents=buffer["documents"][i : i + upsert_size],
+                    metadatas=buffer["metadatas"][i : i + upsert_size],
+                )
+            bm25.add(buffer["ids"], buffer["documents"])
+            bm25.commit()
+            chunks += len(embeddings)
+            for key in buffer:
+                buffer[key] = []
+
+            # Todo lo que estaba en el buffer ya está en Chroma
+            manifest.update(buffered_files)
+            save_manifest(manifest_db, buffered_files)
+            indexed += len(buffered_files)
+            buffered_files.clear()
+            elapsed = time.perf_counter() - deleted
+            print(
+                f"  {indexed}/{len(to_index)} files, {chunks} embeddings "
+                f"({chunks / elapsed:.1f} emb/s)"
+            )
+
+        def jobs():
+            for rel in to_index:
+                if files[rel] is not None:
+                    yield rel, files[rel]
+            label_keys = {rel[len("labels/") :] for rel in to_index if files[rel] is None}
+            if label_keys:
+                label_count = sum(1 for rel in files if files[rel] is None)
+                # Reindexado completo: leer la tabla en orden, sin IN (...)
+                rows = labels.rows(None if len(label_keys) == label_count else label_keys)
+                for row in rows:
+                    yield f"labels/{row['key']}", row
+
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for rel, ids, texts, metadatas in bounded_map(
+                executor, chunk_job, jobs(), args.workers * 4
+            ):
+                buffer["ids"] += ids
+                buffer["documents"] += texts
+                buffer["metadatas"] += metadatas
+                buffered_files[rel] = {"hash": hashes[rel], "node_ids": ids}
+                if len(buffer["ids"]) >= args.batch_size:
+                    flush()
+        flush()
+    embedded = time.perf_counter()
+    if labels is not None:
+        labels.close()
+    if to_index or removed or not os.path.exists(bm25.snapshot_path()):
+        # Arrays que carga rag_api (antes de tocar la marca de versión)
+        bm25.export()
+    bm25.close()
+    manifest_db.close()
+
+    if to_index or removed:
+        # Marca de versión del índice: rag_api vacía su caché semántica al cambiar
+        with open(INDEX_VERSION_PATH, "w", encoding="utf-8") as f:
+            f.write(str(time.time()))
+
+    print(
+        f"Docs: {skipped} skipped, {len(added)} added, {len(updated)} updated, "
+        f"{len(removed)} removed."
+    )
+    embed_time = embedded - deleted
+    if to_index and embed_time > 0:
+        print(
+            f"Throughput: {len(to_index) / embed_time:.1f} docs/s, "
+            f"{chunks / embed_time:.1f} embeddings/s"
+        )
+    print(
+        f"Timings: scan {scanned - started:.2f}s, delete {deleted - scanned:.2f}s, "
+        f"embed {embedded - deleted:.2f}s, total {time.perf_counter() - started:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import unicodedata
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_name(name: str) -> str:
+    """Nombre comercial normalizado: NFKC, sin mayúsculas ni espacios repetidos."""
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", name).casefold()).strip()
+
+
+def record_key(name: str) -> str:
+    return normalize_name(name)
+
+
+class MedicationStore:
+    """Almacén append-only de medicamentos en JSON Lines.
+
+    Cada registro es una línea de ``medications.jsonl``. Al lado vive un índice
+    binario (``medications.idx``) con entradas ``<offset u64><len u16><nombre>``
+    para leer cualquier medicamento por nombre con un solo seek, sin cargar el
+    fichero entero. Se escribe primero la línea y después su entrada de índice;
+    al abrir se repara lo que un corte haya dejado a medias.
+    """
+
+    _ENTRY = struct.Struct("<QH")
+
+    def __init__(self, jsonl_path, index_path=None):
+        self.jsonl_path = jsonl_path
+        self.index_path = index_path or os.path.splitext(jsonl_path)[0] + ".idx"
+        self.offsets = {}
+        self._data = None
+        self._index = None
+
+    def open(self):
+        self._data = open(self.jsonl_path, "a+b")
+        self._index = open(self.index_path, "a+b")
+        self._load_index()
+        self._recover()
+        return self
+
+    def close(self):
+        for f in (self._data, self._index):
+            if f is not None:
+                f.close()
+        self._data = self._index = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return record_key(name) in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _load_index(self):
+        self._index.seek(0)
+        raw = self._index.read()
+        pos = 0
+        valid_end = 0
+        while pos + self._ENTRY.size <= len(raw):
+            offset, size = self._ENTRY.unpack_from(raw, pos)
+            end = pos + self._ENTRY.size + size
+            if end > len(raw):
+                break
+            key = raw[pos + self._ENTRY.size : end].decode("utf-8")
+            self.offsets[key] = offset
+            pos = valid_end = end
+        if valid_end < len(raw):
+            self._index.truncate(valid_end)
+
+    def _recover(self):
+        """Indexa líneas escritas sin entrada de índice y corta una línea a medias."""
+        self._data.seek(0, os.SEEK_END)
+        size = self._data.tell()
+        valid = {key: offset for key, offset in self.offsets.items() if offset < size}
+        if len(valid) != len(self.offsets):
+            self.offsets = valid
+            self._rewrite_index()
+
+        pos = 0
+        if self.offsets:
+            self._data.seek(max(self.offsets.values()))
+            line = self._data.readline()
+            pos = self._data.tell() if line.endswith(b"\n") else self._data.tell() - len(line)
+
+        self._data.seek(pos)
+        while True:
+            offset = self._data.tell()
+            line = self._data.readline()
+            if not line:
+                break
+            if not line.endswith(b"\n"):
+                self._data.truncate(offset)
+                break
+            self._add_to_index(json.loads(line)["name"], offset)
+
+    def _rewrite_index(self):
+        self._index.truncate(0)
+        for key, offset in self.offsets.items():
+            encoded = key.encode("utf-8")
+            self._index.write(self._ENTRY.pack(offset, len(encoded)) + encoded)
+        self._index.flush()
+
+    def _add_to_index(self, name, offset):
+        key = record_key(name)
+        encoded = key.encode("utf-8")
+        self._index.write(self._ENTRY.pack(offset, len(encoded)) + encoded)
+        self._index.flush()
+        self.offsets[key] = offset
+
+    def append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._data.seek(0, os.SEEK_END)
+        offset = self._data.tell()
+        self._data.write(line)
+        self._data.flush()
+        self._add_to_index(record["name"], offset)
+
+    def get(self, name):
+        offset = self.offsets.get(record_key(name))
+        if offset is None:
+            return None
+        self._data.seek(offset)
+        return json.loads(self._data.readline())
+
+
+def iter_records(jsonl_path):
+    """Lee medications.jsonl línea a línea, con memoria constante."""
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n"):
+                yield json.loads(line)
+
+
+class NameIndex:
+    """Índice persistente (SQLite) de medicamentos ya guardados.
+
+    Evita duplicados por nombre normalizado y por ``set_id`` de OpenFDA, y
+    recuerda qué fichero markdown tiene cada uno, así que deduplicar no
+    requiere listar ``docs/`` ni comprobar ficheros uno a uno. Las claves se
+    cargan una vez en memoria y cada alta se escribe en la base de datos.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.keys = {}
+        self.set_ids = set()
+        self.filenames = set()
+        self.rendered = {}
+        self._db = None
+
+    def open(self, seed_records=(), seed_dir=None, candidates=None):
+        is_new = not os.path.exists(self.db_path)
+        self._db = sqlite3.connect(self.db_path)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS names (
+                key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                set_id TEXT,
+                filename TEXT UNIQUE
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS names_set_id ON names (set_id)")
+        # Hash del registro con el que se generó cada markdown
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS rendered (
+                filename TEXT PRIMARY KEY,
+                hash TEXT NOT NULL
+            )"""
+        )
+        if is_new:
+            self._seed(seed_records, seed_dir, candidates or (lambda name: []))
+
+        for key, set_id, filename in self._db.execute(
+            "SELECT key, set_id, filename FROM names"
+        ):
+            self.keys[key] = filename
+            if set_id:
+                self.set_ids.add(set_id)
+            if filename:
+                self.filenames.add(filename)
+        self.rendered = dict(self._db.execute("SELECT filename, hash FROM rendered"))
+        return self
+
+    def _seed(self, seed_records, seed_dir, candidates):
+        """Migración única desde lo que ya había antes de existir el índice.
+
+        ``candidates(name)`` da los nombres de fichero que pudo usar una
+        versión anterior para ese medicamento, para enlazarlo con su markdown.
+        """
+        files = set()
+        if seed_dir and os.path.isdir(seed_dir):
+            files = {f for f in os.listdir(seed_dir) if f.endswith(".md")}
+
+        rows = []
+        for record in seed_records:
+            name = record["name"]
+            filename = next((f for f in candidates(name) if f in files), None)
+            files.discard(filename)
+            rows.append((normalize_name(name), name, record.get("set_id"), filename))
+        # Markdown antiguos sin registro: solo se reserva el nombre de fichero
+        rows += [(f"file:{filename}", filename, None, filename) for filename in files]
+        self._db.executemany("INSERT OR IGNORE INTO names VALUES (?, ?, ?, ?)", rows)
+        self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def seen(self, name, set_id=None):
+        return normalize_name(name) in self.keys or (set_id and set_id in self.set_ids)
+
+    def reserve_filename(self, base):
+        """Nombre de fichero libre: base.md o, si ya está cogido, base__N.md."""
+        filename = f"{base}.md"
+        suffix = 1
+        while filename in self.filenames:
+            suffix += 1
+            filename = f"{base}__{suffix}.md"
+        return filename
+
+    def add(self, name, set_id=None, filename=None):
+        key = normalize_name(name)
+        self._db.execute(
+            "INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)",
+            (key, name, set_id, filename),
+        )
+        self.keys[key] = filename
+        if set_id:
+            self.set_ids.add(set_id)
+        if filename:
+            self.filenames.add(filename)
+
+    def filename_for(self, name):
+        return self.keys.get(normalize_name(name))
+
+    def rendered_hash(self, filename):
+        return self.rendered.get(filename)
+
+    def set_rendered(self, filename, digest):
+        self._db.execute(
+            "INSERT OR REPLACE INTO rendered VALUES (?, ?)", (filename, digest)
+        )
+        self.rendered[filename] = digest
+
+    def commit(self):
+        self._db.commit()
+
+    @property
+    def connection(self):
+        return self._db
+
+
+# Secciones de una etiqueta, en el orden del markdown
+LABEL_SECTIONS = [
+    "active_ingredient",
+    "purpose",
+    "description",
+    "indications",
+    "warnings",
+    "contraindications",
+    "when_using",
+    "stop_use",
+    "keep_out",
+    "side_effects",
+    "dosage",
+    "storage",
+    "inactive_ingredients",
+    "questions",
+]
+LABEL_COLUMNS = ["name", "name_es", "name_fr", "set_id", "manufacturer", *LABEL_SECTIONS]
+# Valores de relleno de format_markdown: se guardan como NULL
+_PLACEHOLDERS = {"", "Not available.", "Not specified", "No description", "Unknown"}
+
+
+class LabelStore:
+    """Tabla ``labels`` de medications.db: una fila por medicamento y una
+    columna por sección de la etiqueta.
+
+    Sustituye a los markdown por medicamento como fuente del índice: las
+    secciones vacías ocupan NULL, se lee en streaming con mmap y
+    ``row_hash`` permite a index_documents.py saber qué cambió sin leer el
+    texto.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = None
+        self._owns_db = True
+
+    def open(self, connection=None, readonly=False):
+        """``connection``: conexión ya abierta a la misma base (la del
+        NameIndex). Escribir las dos tablas por conexiones distintas bloquea
+        la base; compartida, ``close`` solo hace commit.
+
+        ``readonly`` (index_documents.py) no crea la tabla: una base que solo
+        tiene ``names`` se queda como está y ``has_rows`` devuelve False.
+        """
+        self._owns_db = connection is None
+        if connection is not None:
+            self._db = connection
+        elif readonly:
+            self._db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        else:
+            self._db = sqlite3.connect(self.db_path)
+        self._db.execute("PRAGMA mmap_size = 268435456")
+        if readonly:
+            return self
+        columns = ", ".join(f"{column} TEXT" for column in LABEL_COLUMNS[1:])
+        self._db.execute(
+            f"""CREATE TABLE IF NOT EXISTS labels (
+                key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                {columns},
+                row_hash TEXT NOT NULL
+            )"""
+        )
+        return self
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            if self._owns_db:
+                self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def upsert(self, record):
+        values = [record["name"]] + [
+            None if record.get(column) in _PLACEHOLDERS else record.get(column)
+            for column in LABEL_COLUMNS[1:]
+        ]
+        row_hash = hashlib.sha1(
+            json.dumps(values, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        placeholders = ", ".join("?" for _ in range(len(LABEL_COLUMNS) + 2))
+        self._db.execute(
+            f"INSERT OR REPLACE INTO labels (key, {', '.join(LABEL_COLUMNS)}, row_hash) "
+            f"VALUES ({placeholders})",
+            [normalize_name(record["name"]), *values, row_hash],
+        )
+
+    def commit(self):
+        self._db.commit()
+
+    def has_rows(self):
+        """Si existe la tabla labels y tiene al menos una fila."""
+        exists = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'labels'"
+        ).fetchone()
+        return bool(exists) and bool(
+            self._db.execute("SELECT 1 FROM labels LIMIT 1").fetchone()
+        )
+
+    def hashes(self):
+        """key -> row_hash de todas las filas, sin leer las secciones."""
+        return dict(self._db.execute("SELECT key, row_hash FROM labels"))
+
+    def rows(self, keys=None):
+        """Filas como dict (solo columnas no nulas), en streaming."""
+        query = f"SELECT key, {', '.join(LABEL_COLUMNS)} FROM labels"
+        columns = ["key", *LABEL_COLUMNS]
+        if keys is None:
+            cursor = self._db.execute(query)
+            for row in cursor:
+                yield {c: v for c, v in zip(columns, row) if v is not None}
+            return
+
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            cursor = self._db.execute(
+                f"{query} WHERE key IN ({', '.join('?' for _ in batch)})", batch
+            )
+            for row in cursor:
+                yield {c: v for c, v in zip(columns, row) if v is not None}
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Intención "pregunta sobre la app": palabras completas, no subcadenas
+# ("happen" o "apply" ya no disparan el fallback).
+MEDITIME_INTENT = re.compile(
+    r"\b(?:medi\s?time|apps?|aplicaci[oó]n(?:es)?|applications?)\b", re.IGNORECASE
+)
+_WORDS = re.compile(r"\w{3,}")
+_SECTIONS = re.compile(r"(?m)^(?=#{1,3} )")
+
+
+class FallbackDocument:
+    """Documento de MediTime cargado y troceado una sola vez.
+
+    Se trocea por encabezados markdown (y por tamaño si una sección es muy
+    larga) y se recarga solo cuando cambia el fichero en disco.
+    """
+
+    def __init__(self, path, max_chunk_chars=1200):
+        self.path = path
+        self.max_chunk_chars = max_chunk_chars
+        self.chunks = []
+        self._mtime = None
+
+    def load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            logger.error("❌ MediTime fallback disabled, file not found path=%s", self.path)
+            self.chunks, self._mtime = [], None
+            return
+
+        chunks = []
+        for section in _SECTIONS.split(text):
+            section = section.strip()
+            while len(section) > self.max_chunk_chars:
+                cut = section.rfind("\n", 0, self.max_chunk_chars)
+                cut = cut if cut > 0 else self.max_chunk_chars
+                chunks.append(section[:cut].strip())
+                section = section[cut:].strip()
+            if section:
+                chunks.append(section)
+
+        self.chunks = [(chunk, set(_WORDS.findall(chunk.lower()))) for chunk in chunks]
+        self._mtime = mtime
+        logger.info("📄 Loaded MediTime fallback chunks=%d", len(self.chunks))
+
+    async def watch(self, interval=5.0):
+        """Recarga el documento cuando cambia su mtime."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._mtime:
+                self.load()
+
+    @staticmethod
+    def matches(prompt: str) -> bool:
+        return MEDITIME_INTENT.search(prompt) is not None
+
+    def select(self, prompt: str, limit=3):
+        """Los trozos que más palabras comparten con el prompt, en orden original."""
+        words = set(_WORDS.findall(prompt.lower()))
+        ranked = sorted(
+            range(len(self.chunks)),
+            key=lambda i: len(words & self.chunks[i][1]),
+            reverse=True,
+        )
+        return [self.chunks[i][0] for i in sorted(ranked[:limit])]
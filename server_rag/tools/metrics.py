@@ -0,0 +1,67 @@
+"""Métricas Prometheus de la API RAG (expuestas en /metrics).
+
+Las latencias van en segundos. Los histogramas y contadores son seguros
+entre hilos, así que las etapas que corren en los pools de retrieval los
+actualizan directamente.
+"""
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# Etapas rápidas (embedding, Chroma, BM25, prompt): de 1 ms a 5 s
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Generación: hasta FIRST_CHUNK_TIMEOUT (60 s por defecto) y algo más
+STREAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+EMBEDDING_SECONDS = Histogram(
+    "rag_embedding_seconds",
+    "Embedding del prompt (incluye la espera del batch)",
+    buckets=STAGE_BUCKETS,
+)
+CHROMA_SECONDS = Histogram(
+    "rag_chroma_seconds",
+    "Llamadas a Chroma (query multi-prompt o get por ids/metadatos)",
+    ["operation"],
+    buckets=STAGE_BUCKETS,
+)
+RETRIEVAL_SECONDS = Histogram(
+    "rag_retrieval_seconds",
+    "Retrieval completo de /context: medicamentos por nombre + híbrido",
+    buckets=STAGE_BUCKETS,
+)
+PROMPT_BUILD_SECONDS = Histogram(
+    "rag_prompt_build_seconds",
+    "Montaje del prompt dentro del presupuesto de tokens",
+    buckets=STAGE_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "rag_time_to_first_token_seconds",
+    "Desde que llega la petición hasta el primer chunk enviado al cliente",
+    buckets=STREAM_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "rag_tokens_per_second",
+    "Velocidad de generación de Ollama desde el primer token",
+    buckets=RATE_BUCKETS,
+)
+STREAM_SECONDS = Histogram(
+    "rag_stream_seconds",
+    "Duración total de la respuesta de /context",
+    buckets=STREAM_BUCKETS,
+)
+
+CACHE_LOOKUPS = Counter(
+    "rag_cache_lookups_total", "Consultas a las cachés", ["cache", "result"]
+)
+TIMEOUTS = Counter(
+    "rag_timeouts_total", "Etapas que superaron su plazo", ["stage"]
+)
+DISCONNECTS = Counter(
+    "rag_client_disconnects_total", "Clientes desconectados antes de acabar el stream"
+)
+ERRORS = Counter("rag_errors_total", "Errores por etapa", ["stage"])
+
+
+def render():
+    """Cuerpo y content type de la respuesta de /metrics."""
+    return generate_latest(), CONTENT_TYPE_LATEST
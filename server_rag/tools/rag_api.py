@@ -1,32 +1,138 @@
 from fastapi import FastAPI, Request
-from pydantic import BaseModel
-from llama_index.core import load_index_from_storage, Settings
-from llama_index.core.storage.storage_context import StorageContext
-from llama_index.llms.ollama import Ollama
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+from llama_index.core import Settings
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.vector_stores.chroma import ChromaVectorStore
 import chromadb
-from pydantic import BaseModel
 import ollama
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import time
 import asyncio
+import json
+import logging
 import signal
 import sys
+from config import (
+    OLLAMA_HOSTS,
+    OLLAMA_MAX_STREAMS_PER_HOST,
+    OLLAMA_HEALTH_INTERVAL,
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_BATCH_QUEUE_SHARE,
+    MODELO,
+    OLLAMA_KEEP_ALIVE,
+    FIRST_CHUNK_TIMEOUT,
+    RETRIEVAL_BATCH_WINDOW_MS,
+    RETRIEVAL_MAX_BATCH,
+    RETRIEVAL_WORKERS,
+    DEFAULT_TOP_K,
+    MAX_TOP_K,
+    EMBED_CACHE_SIZE,
+    EMBED_CACHE_TTL,
+    EMBED_CACHE_PATH,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_DISTANCE,
+    INDEX_VERSION_PATH,
+    MEDITIME_DOC_PATH,
+    MEDITIME_MAX_CHUNKS,
+    DRUG_LOOKUP_DB,
+    DRUG_LOOKUP_MAX_DRUGS,
+    DRUG_LOOKUP_PER_INGREDIENT,
+    DRUG_LOOKUP_MAX_LABELS_PER_NAME,
+    DRUG_LOOKUP_MAX_DISTANCE,
+    BM25_PATH,
+    HYBRID_CANDIDATES,
+    RRF_K,
+    VECTOR_BUDGET_MS,
+    BM25_BUDGET_MS,
+    PROMPT_MAX_TOKENS,
+    CONTEXT_MIN_CHUNK_TOKENS,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    TRACE_EXPORTER,
+    TRACE_SAMPLE_RATE,
+    TRACE_JSON_PATH,
+    TRACE_OTLP_ENDPOINT,
+)
+from retrieval import BatchedRetriever, HybridRetriever
+from bm25 import BM25Index
+from context_assembler import ContextAssembler
+from embedding_cache import EmbeddingCache, CachedEmbedding, normalize_prompt
+from response_cache import SemanticResponseCache
+from meditime_fallback import FallbackDocument
+from medication_store import LABEL_SECTIONS, normalize_name
+from drug_lookup import DrugNameMatcher
+from prompts import get_system_prompt
+from backend_pool import BackendPool
+from admission import AdmissionController, AdmissionRejected
+from single_flight import SingleFlight
+from metrics import (
+    EMBEDDING_SECONDS,
+    RETRIEVAL_SECONDS,
+    PROMPT_BUILD_SECONDS,
+    TIME_TO_FIRST_TOKEN_SECONDS,
+    TOKENS_PER_SECOND,
+    STREAM_SECONDS,
+    CACHE_LOOKUPS,
+    TIMEOUTS,
+    DISCONNECTS,
+    ERRORS,
+    render as render_metrics,
+)
+from tracing import Tracer, create_sink, current_span, span, use_span
+
+# Logging por niveles: los mensajes por petición son DEBUG y no cuestan
+# nada (ni se formatean) con el nivel por defecto
+logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+logging.getLogger("httpx").setLevel(logging.WARNING)  # Una línea por chunk/health check
+logger = logging.getLogger("rag_api")
+
+# Trazas de una fracción de las peticiones (exportadas en segundo plano)
+tracer = Tracer(
+    create_sink(TRACE_EXPORTER, TRACE_JSON_PATH, TRACE_OTLP_ENDPOINT, "rag_api"),
+    sample_rate=TRACE_SAMPLE_RATE,
+)
+
+# Pool de hosts de Ollama para /context: cada stream va al host menos
+# cargado y se lee con httpx sobre el event loop, así una generación lenta
+# no bloquea al resto de peticiones.
+backend_pool = BackendPool(OLLAMA_HOSTS, max_streams_per_host=OLLAMA_MAX_STREAMS_PER_HOST)
+
+# Control de admisión delante de la generación: generaciones en vuelo
+# acotadas (por defecto, la capacidad del pool) y cola con plazo
+admission = AdmissionController(
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT
+    or len(OLLAMA_HOSTS) * OLLAMA_MAX_STREAMS_PER_HOST,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    batch_queue_share=ADMISSION_BATCH_QUEUE_SHARE,
+)
 
-ollamaLoaded = ollama.Client()
-MODELO = "llama3"
+# Peticiones idénticas simultáneas (mismo prompt normalizado, idioma, top_k
+# y filtro) se suscriben a una única generación
+flights = SingleFlight()
 
 
 def warm_up_model():
-    print(f"🔥 Precargando modelo '{MODELO}'...")
-    ollamaLoaded.generate(
-        model=MODELO,
-        prompt="Hola",
-        stream=False,
-        keep_alive="1h",  # Asegúrate que no se descargue
-    )
-    print("✅ Modelo cargado.")
+    for backend in backend_pool.backends:
+        logger.info("🔥 Precargando modelo model=%s host=%s", MODELO, backend.host)
+        try:
+            ollama.Client(host=backend.host).generate(
+                model=MODELO,
+                # Con el system prompt por defecto ya evaluado, la primera
+                # petición real solo evalúa su contexto
+                system=get_system_prompt("es"),
+                prompt="Hola",
+                stream=False,
+                keep_alive=OLLAMA_KEEP_ALIVE,  # Asegúrate que no se descargue
+            )
+        except Exception as e:
+            # El health check lo volverá a dar por sano cuando responda
+            backend_pool.mark_failed(backend, e)
+            continue
+        logger.info("✅ Modelo cargado host=%s", backend.host)
 
 
 warm_up_model()
@@ -34,90 +140,171 @@ warm_up_model()
 app = FastAPI()
 
 
+async def end_span_after(body, root):
+    """Cierra el span raíz cuando termina de enviarse el cuerpo."""
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        root.end()
+
+
 # Middleware para manejar cancelaciones
 @app.middleware("http")
 async def cancel_on_disconnect(request: Request, call_next):
-    print(f"🌐 Incoming request: {request.method} {request.url}")
     start_time = time.time()
-
-    try:
-        print("🔄 Processing request...")
-
-        # Check if client is still connected before processing
+    # Span raíz de la petición, hijo del traceparent del cliente (rag.ts)
+    root = tracer.start(
+        f"{request.method} {request.url.path}",
+        request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path},
+    )
+    if logger.isEnabledFor(logging.DEBUG):
         client_host = request.client.host if request.client else "unknown"
-        print(f"🌐 Client: {client_host}")
-
-        response = await call_next(request)
-
-        elapsed = time.time() - start_time
-        print(f"✅ Request processed successfully in {elapsed:.2f}s")
+        logger.debug(
+            "🌐 Incoming request method=%s url=%s client=%s",
+            request.method,
+            request.url,
+            client_host,
+        )
+
+    # Hasta las cabeceras de la respuesta; el stream va en el span raíz
+    middleware_span = root.child("http.middleware")
+    try:
+        with use_span(root):
+            response = await call_next(request)
+        middleware_span.end()
+        logger.debug("✅ Request processed elapsed=%.2fs", time.time() - start_time)
+        if root.sampled:
+            root.set(**{"http.status_code": response.status_code})
+            response.body_iterator = end_span_after(response.body_iterator, root)
         return response
-    except asyncio.CancelledError:
-        elapsed = time.time() - start_time
-        print(f"🔌 Request cancelled during processing after {elapsed:.2f}s")
+    except asyncio.CancelledError as e:
+        middleware_span.end(error=e)
+        root.end(error=e)
+        logger.info(
+            "🔌 Request cancelled during processing elapsed=%.2fs",
+            time.time() - start_time,
+        )
         raise
     except Exception as e:
-        elapsed = time.time() - start_time
-        print(f"❌ Error in middleware after {elapsed:.2f}s: {str(e)}")
+        middleware_span.end(error=e)
+        root.end(error=e)
+        logger.error(
+            "❌ Error in middleware elapsed=%.2fs error=%s", time.time() - start_time, e
+        )
         raise
 
 
-def get_system_prompt(lang="es"):
-    return f"""You are an assistant that provides only the necessary context or summarized information based on the user's prompt. This context will be used by another AI to generate a complete response for the user. Follow these rules strictly:
-
-Respond only with relevant context based on the user's prompt.
-If the user's prompt requires factual information to form a complete response, provide only the essential, summarized information directly related to the prompt.
-Do not repeat or rephrase the user's prompt.
-Do not provide full answers or completions—only the context or summarized info needed to generate a complete response.
-Respond only in the language specified by the user. If no language is specified, respond in Spanish.
-Be concise and precise—include only what is strictly necessary.
-If the user's prompt is **not related to health, medicine, drugs/pills, or the MediTime app**, politely reject the request and do not provide any context.
-If the user's prompt is about **MediTime**, provide a short summary of the app's functionality, purpose, and key features.
-Never include explanations or extra commentary—your response must be minimal and to the point.
-If the information provided is not sufficient to answer the user's question, you can answer with your own knowledge.
-
-Important Behavior Rule:
-If the user's prompt is not related to health, medicine, pills/drugs, or the MediTime app, reject the request politely and concisely, in the language specified.
+# 1. Configurar embeddings (la generación va directa al BackendPool)
+Settings.embed_model = HuggingFaceEmbedding(
+    model_name="sentence-transformers/all-MiniLM-L6-v2"
+)
 
-Respond only in this language: **{lang}**. If the user specifies a language, respond in the language specified by the user."""
+# 2. Abrir la colección Chroma. index_documents.py escribe en ella
+# directamente y la etapa de retrieval la consulta sin índice de llama_index.
+chroma_client = chromadb.PersistentClient(path="./storage")
+chroma_collection = chroma_client.get_or_create_collection("rag")
 
+# Caché de embeddings delante de Settings.embed_model
+embedding_cache = EmbeddingCache(
+    max_size=EMBED_CACHE_SIZE, ttl=EMBED_CACHE_TTL, path=EMBED_CACHE_PATH or None
+)
+logger.info("🧠 Loaded cached query embeddings count=%d", embedding_cache.load())
+
+# Etapa de retrieval con batching (embedding + Chroma fuera del event loop)
+retriever = BatchedRetriever(
+    CachedEmbedding(Settings.embed_model, embedding_cache),
+    chroma_collection,
+    window_ms=RETRIEVAL_BATCH_WINDOW_MS,
+    max_batch=RETRIEVAL_MAX_BATCH,
+    workers=RETRIEVAL_WORKERS,
+)
 
-# 1. Configurar LLM y embeddings
-llm = Ollama(
-    model=MODELO,
-    system_prompt=get_system_prompt(lang="es"),
-    request_timeout=120.0,
-    base_url="http://localhost:11434",
-    keep_alive=True,
-    streaming=True,
+# Índice BM25 en memoria; la búsqueda vectorial y la léxica se fusionan
+bm25_index = BM25Index(BM25_PATH)
+logger.info("🔤 Loaded BM25 index nodes=%d", bm25_index.load())
+hybrid_retriever = HybridRetriever(
+    retriever,
+    bm25_index,
+    candidates=HYBRID_CANDIDATES,
+    rrf_k=RRF_K,
+    vector_budget_ms=VECTOR_BUDGET_MS,
+    bm25_budget_ms=BM25_BUDGET_MS,
 )
 
-Settings.llm = llm
-Settings.embed_model = HuggingFaceEmbedding(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
+# Contextos ya generados, reutilizados para prompts casi idénticos
+response_cache = SemanticResponseCache(
+    max_size=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    max_distance=RESPONSE_CACHE_MAX_DISTANCE,
+    version_path=INDEX_VERSION_PATH,
 )
 
-# 2. Reconstruir vector store Chroma
-chroma_client = chromadb.PersistentClient(path="./storage")
-vector_store = ChromaVectorStore(
-    chroma_collection=chroma_client.get_or_create_collection("rag")
+# Prompt final recortado a PROMPT_MAX_TOKENS
+context_assembler = ContextAssembler(
+    max_tokens=PROMPT_MAX_TOKENS, min_chunk_tokens=CONTEXT_MIN_CHUNK_TOKENS
 )
 
-# 3. Crear storage_context usando ese vector_store
-storage_context = StorageContext.from_defaults(
-    persist_dir="./storage", vector_store=vector_store
+# Documento de MediTime en memoria (se recarga si cambia en disco)
+meditime_doc = FallbackDocument(MEDITIME_DOC_PATH)
+meditime_doc.load()
+
+# Nombres de medicamentos (marcas, es/fr y principios activos) para buscar
+# por nombre sin pasar por la búsqueda vectorial
+drug_matcher = DrugNameMatcher(
+    DRUG_LOOKUP_DB,
+    max_drugs_per_ingredient=DRUG_LOOKUP_PER_INGREDIENT,
+    max_labels_per_name=DRUG_LOOKUP_MAX_LABELS_PER_NAME,
 )
+logger.info("💊 Loaded drug names count=%d", drug_matcher.load())
 
-# 4. Cargar índice
-index = load_index_from_storage(storage_context)
 
-query_engine = index.as_query_engine(similarity_top_k=3)
+# Contadores de generaciones (expuestos en /health). Un chunk de Ollama es un
+# token, así que los tokens ahorrados se estiman contra la media de las
+# generaciones completas.
+generation_stats = {
+    "completed": 0,
+    "aborted": 0,
+    "tokens_generated": 0,
+    "tokens_saved": 0,
+}
 
 
-# 5. API
+def record_generation(tokens: int, aborted: bool):
+    if not aborted:
+        generation_stats["completed"] += 1
+        generation_stats["tokens_generated"] += tokens
+        return
+
+    generation_stats["aborted"] += 1
+    completed = generation_stats["completed"]
+    if completed:
+        average = generation_stats["tokens_generated"] / completed
+        generation_stats["tokens_saved"] += max(0, round(average - tokens))
+
+
+# 3. API
 class PromptRequest(BaseModel):
     prompt: str
     lang: str = "es"
+    top_k: int = Field(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K)
+    # Filtros opcionales sobre los nodos por sección de index_documents.py
+    section: Optional[Literal[tuple(LABEL_SECTIONS)]] = None
+    drug: Optional[str] = None
+    # Las peticiones batch ceden el paso a las interactivas en la cola
+    priority: Literal["interactive", "batch"] = "interactive"
+
+    def where(self):
+        """Filtro de metadatos de Chroma para section/drug (o None)."""
+        filters = []
+        if self.section:
+            filters.append({"section": self.section})
+        if self.drug:
+            filters.append({"drug_key": normalize_name(self.drug)})
+        if len(filters) > 1:
+            return {"$and": filters}
+        return filters[0] if filters else None
 
 
 @app.get("/")
@@ -127,155 +314,361 @@ async def health_check():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "model": MODELO, "timestamp": time.time()}
+    return {
+        "status": "healthy",
+        "model": MODELO,
+        "timestamp": time.time(),
+        "generations": generation_stats,
+        "embedding_cache": embedding_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "drug_lookup": drug_matcher.stats(),
+        "hybrid_retrieval": hybrid_retriever.stats(),
+        "context": context_assembler.stats(),
+        "ollama": backend_pool.stats(),
+        "admission": admission.stats(),
+        "single_flight": flights.stats(),
+        "tracing": tracer.stats(),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
 
 
 @app.post("/test")
 async def test_endpoint(req: PromptRequest):
-    print(f"🧪 Test endpoint received: {req.prompt}")
-    return {"received": req.prompt, "lang": req.lang, "status": "ok"}
+    logger.debug("🧪 Test endpoint received prompt=%r", req.prompt)
+    return {
+        "received": req.prompt,
+        "lang": req.lang,
+        "top_k": req.top_k,
+        "where": req.where(),
+        "status": "ok",
+    }
+
+
+async def retrieve_nodes(req: PromptRequest, embedding, where):
+    """Secciones de los medicamentos nombrados y, si faltan, búsqueda híbrida."""
+    nodes = []
+    # Medicamentos nombrados en el prompt: sus secciones se leen directamente.
+    # Las coincidencias por error las filtran el matcher (palabras comunes,
+    # nombres compartidos por muchos productos) y el corte por distancia.
+    drug_keys = [] if req.drug else drug_matcher.find(
+        req.prompt, limit=DRUG_LOOKUP_MAX_DRUGS
+    )
+    if drug_keys:
+        nodes = await retriever.fetch_drugs(
+            drug_keys,
+            embedding,
+            top_k=req.top_k,
+            section=req.section,
+            max_distance=DRUG_LOOKUP_MAX_DISTANCE,
+        )
+        logger.debug("💊 Drug lookup drugs=%s sections=%d", drug_keys, len(nodes))
+
+    # La búsqueda híbrida (BM25 + vectorial) solo completa lo que falte
+    remaining = req.top_k - len(nodes)
+    if remaining > 0:
+        fetched = {node.node.node_id for node in nodes}
+        hybrid_nodes = await hybrid_retriever.retrieve(
+            req.prompt, top_k=req.top_k, embedding=embedding, where=where
+        )
+        nodes += [node for node in hybrid_nodes if node.node.node_id not in fetched][
+            :remaining
+        ]
+    return nodes
 
 
 @app.post("/context")
 async def get_context(req: PromptRequest, request: Request):
-    print(f"📥 Received prompt: {req.prompt} in language: {req.lang}")
-    print(f"🔍 Client info: {request.client}")
-    print(f"📡 Headers: {dict(request.headers)}")
+    received = time.perf_counter()
+    received_ns = time.time_ns()
+    trace = current_span()
+    trace.set(
+        **{"rag.lang": req.lang, "rag.top_k": req.top_k, "rag.priority": req.priority}
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "📥 Received prompt lang=%s top_k=%d client=%s prompt=%r headers=%s",
+            req.lang,
+            req.top_k,
+            request.client,
+            req.prompt,
+            dict(request.headers),
+        )
 
     try:
-        print("🔍 Starting retrieval...")
-        retriever = index.as_retriever(similarity_top_k=2)
-        nodes = retriever.retrieve(req.prompt)
-        textNodes = "\n".join([node.node.text for node in nodes])
-        print(f"📝 Retrieved {len(nodes)} nodes")
-
-        prompt = "\n\n".join([get_system_prompt(lang=req.lang), textNodes, req.prompt])
-        print("📝 Prompt prepared")
-
-        # Fallback si no se recuperó nada relevante sobre MediTime
-        if (
-            "meditime" in req.prompt.lower()
-            or "app" in req.prompt.lower()
-            or "aplicaci" in req.prompt.lower()
-        ) and "meditime" not in textNodes.lower():
-            print("⚠️ No se encontró info sobre MediTime. Usando fallback manual.")
-            try:
-                with open("./docs/meditime.md", "r", encoding="utf-8") as f:
-                    textNodes = f.read()
-            except FileNotFoundError:
-                print("❌ meditime.md not found, continuing without fallback")
-
-        print("🚀 Starting stream generator...")
-
+        where = req.where()
+        with EMBEDDING_SECONDS.time(), span("embedding"):
+            embedding = await retriever.embed(req.prompt)
+        # La caché semántica guarda contextos sin filtrar
+        cached_context = None
+        if where is None:
+            cached_context = response_cache.lookup(embedding, (req.lang, req.top_k))
+            CACHE_LOOKUPS.labels(
+                cache="response", result="miss" if cached_context is None else "hit"
+            ).inc()
     except Exception as e:
-        print(f"❌ Error in setup: {str(e)}")
+        ERRORS.labels(stage="setup").inc()
+        logger.error("❌ Error in setup error=%s", e)
         return {"error": f"Setup error: {str(e)}"}
 
-    async def stream_generator():
-        ollama_task = None
-        client_disconnected = False
-        
-        async def check_client_connection():
-            """Check if client is still connected"""
-            nonlocal client_disconnected
-            try:
-                # Try to get client info periodically
-                while not client_disconnected:
-                    await asyncio.sleep(1.0)  # Check every second
-                    # This will throw an exception if client disconnected
-                    if not hasattr(request, 'client') or not request.client:
-                        print("🔌 Client connection lost")
-                        client_disconnected = True
-                        break
-            except asyncio.CancelledError:
-                print("� Client connection check cancelled")
-                client_disconnected = True
-            except Exception as e:
-                print(f"🔌 Client connection check error: {e}")
-                client_disconnected = True
-        
+    if cached_context is not None:
+        trace.set(**{"rag.cache_hit": True})
+        logger.debug("⚡ Semantic cache hit, skipping generation")
+
+        async def cached_stream():
+            yield cached_context.encode("utf-8")
+
+        return StreamingResponse(cached_stream(), media_type="text/plain")
+
+    async def run_generation(flight):
+        """Admisión, recuperación y generación; los chunks van al Flight."""
+        # Esperar hueco de generación (o rechazar rápido si hay demasiada cola)
+        with span("admission.wait"):
+            await admission.acquire(req.priority)
+        start_time = time.time()
+        tokens = 0
+        finished = False
+        first_token_ns = None
         try:
-            print("�🔄 Stream generator started")
-            start_time = time.time()
-
-            # Start client connection monitoring
-            connection_task = asyncio.create_task(check_client_connection())
-
-            # Función para ejecutar la generación de Ollama en un hilo separado
-            def run_ollama_generation():
-                print("🤖 Starting Ollama generation...")
-                return ollamaLoaded.generate(
-                    model=MODELO,
-                    prompt=prompt,
-                    stream=True,
+            with RETRIEVAL_SECONDS.time(), span("retrieval") as retrieval_span:
+                nodes = await retrieve_nodes(req, embedding, where)
+                retrieval_span.set(nodes=len(nodes))
+            textNodes = [node.node.text for node in nodes]
+            logger.debug("📝 Retrieved nodes=%d", len(nodes))
+
+            # Fallback si no se recuperó nada relevante sobre MediTime. Va
+            # delante de lo recuperado: el assembler llena el presupuesto en
+            # orden y, si no cabe todo, lo que se recorta es lo recuperado.
+            if meditime_doc.matches(req.prompt) and not any(
+                "meditime" in text.lower() for text in textNodes
+            ):
+                logger.debug("⚠️ No se encontró info sobre MediTime, usando fallback manual")
+                textNodes = (
+                    meditime_doc.select(req.prompt, limit=MEDITIME_MAX_CHUNKS) + textNodes
                 )
 
-            # Ejecutar la generación en un executor para poder cancelarla
-            loop = asyncio.get_event_loop()
-            print("🔄 Submitting to executor...")
-            ollama_task = loop.run_in_executor(None, run_ollama_generation)
+            # El system prompt va aparte (campo system): prefijo idéntico en
+            # cada petición del mismo idioma
+            system_prompt = get_system_prompt(lang=req.lang)
+            with PROMPT_BUILD_SECONDS.time(), span("prompt_build") as build_span:
+                prompt, tokens_report = context_assembler.assemble(
+                    system_prompt, textNodes, req.prompt
+                )
+                build_span.set(**tokens_report)
+            logger.debug(
+                "📝 Prompt prepared prompt_tokens=%d retrieved_tokens=%d trimmed_tokens=%d",
+                tokens_report["prompt_tokens"],
+                tokens_report["retrieved_tokens"],
+                tokens_report["trimmed_tokens"],
+            )
 
-            # Esperar la respuesta con timeout
+            flight.start()
+            generation_span = current_span()
+            requested_ns = time.time_ns()
+            # Al salir del with se cierra el stream HTTP y Ollama suelta el modelo
+            async with backend_pool.generate(
+                model=MODELO,
+                system=system_prompt,
+                prompt=prompt,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+            ) as response:
+                async for chunk in response:
+                    if first_token_ns is None:
+                        first_token_ns = time.time_ns()
+                        # Hueco en el pool + carga del modelo + evaluación del prompt
+                        generation_span.record(
+                            "ollama.first_chunk", requested_ns, first_token_ns
+                        )
+                    if chunk.done:
+                        tokens = chunk.eval_count or tokens
+                        elapsed = (time.time_ns() - first_token_ns) / 1e9
+                        if tokens > 1 and elapsed > 0:
+                            TOKENS_PER_SECOND.observe(tokens / elapsed)
+                        if chunk.prompt_eval_duration:
+                            # Según Ollama; termina justo antes del primer token
+                            generation_span.record(
+                                "ollama.prompt_eval",
+                                first_token_ns - chunk.prompt_eval_duration,
+                                first_token_ns,
+                                prompt_tokens=chunk.prompt_eval_count or 0,
+                            )
+                        logger.debug(
+                            "🧮 Prompt eval prompt_eval_count=%s duration_ms=%.0f",
+                            chunk.prompt_eval_count,
+                            (chunk.prompt_eval_duration or 0) / 1e6,
+                        )
+                    else:
+                        tokens += 1
+                    flight.publish(chunk.response)
+            finished = True
+            if where is None:
+                response_cache.store(
+                    embedding, (req.lang, req.top_k), "".join(flight.chunks)
+                )
+        finally:
+            admission.release(held=time.time() - start_time)
+            if first_token_ns is not None:
+                current_span().record(
+                    "ollama.stream",
+                    first_token_ns,
+                    time.time_ns(),
+                    tokens=tokens,
+                    aborted=not finished,
+                )
+            if flight.ready.done():
+                record_generation(tokens, aborted=not finished)
+                if not finished:
+                    logger.info("🛑 Generation aborted tokens=%d", tokens)
+
+    # Las peticiones iguales en curso comparten una sola generación
+    key = (
+        normalize_prompt(req.prompt),
+        req.lang,
+        req.top_k,
+        json.dumps(where, sort_keys=True),
+    )
+    subscription = flights.join(key, run_generation)
+    trace.set(**{"single_flight.leader": subscription.leader})
+    if not subscription.leader:
+        logger.debug(
+            "🔗 Joining in-flight generation subscribers=%d",
+            subscription.flight.subscribers,
+        )
+
+    async def watch_disconnect():
+        """Deja la generación en cuanto el cliente se desconecta.
+
+        Espera el http.disconnect con receive(): detrás del middleware http
+        ``request.is_disconnected()`` nunca lo ve.
+        """
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        DISCONNECTS.inc()
+        logger.info("🔌 Client disconnected, leaving Ollama generation")
+        # Si era el último suscriptor, la generación se aborta
+        subscription.leave()
+
+    # Arranca antes de esperar la admisión: si el cliente se va mientras está
+    # en cola y era el último suscriptor, se cancela la tarea y acquire lo
+    # saca de la cola sin llegar a recuperar ni generar nada.
+    watch_task = asyncio.create_task(watch_disconnect())
+    ready = asyncio.ensure_future(subscription.wait_ready())
+    try:
+        await asyncio.wait({ready, watch_task}, return_when=asyncio.FIRST_COMPLETED)
+        if subscription.left:
+            # Nadie va a leer la respuesta
+            if ready.done() and not ready.cancelled():
+                ready.exception()
+            ready.cancel()
+            return Response(status_code=204)
+        ready.result()
+    except AdmissionRejected as e:
+        watch_task.cancel()
+        subscription.leave()
+        logger.warning(
+            "🚦 Rejected request priority=%s status=%d reason=%s",
+            req.priority,
+            e.status_code,
+            e.reason,
+        )
+        return JSONResponse(
+            {"error": e.reason},
+            status_code=e.status_code,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except BaseException as e:
+        watch_task.cancel()
+        ready.cancel()
+        subscription.leave()
+        if not isinstance(e, Exception):
+            raise
+        ERRORS.labels(stage="setup").inc()
+        logger.error("❌ Error in setup error=%s", e)
+        return {"error": f"Setup error: {str(e)}"}
+
+    async def stream_generator():
+        chunk_count = 0
+        chunks = aiter(subscription)
+        stream_span = None
+
+        try:
+            # La petición HTTP arranca con el primer chunk: el timeout cubre
+            # la carga del modelo y la evaluación del prompt.
             try:
-                print("⏱️ Waiting for Ollama response...")
-                response = await asyncio.wait_for(ollama_task, timeout=60.0)
-                print("✅ Got response from Ollama")
+                item = await asyncio.wait_for(
+                    anext(chunks, None), timeout=FIRST_CHUNK_TIMEOUT
+                )
             except asyncio.TimeoutError:
-                print("❌ Timeout waiting for Ollama response")
+                TIMEOUTS.labels(stage="first_chunk").inc()
+                logger.error("❌ Timeout waiting for Ollama response")
                 yield "[Error: Timeout waiting for response]".encode("utf-8")
                 return
-            finally:
-                connection_task.cancel()
-
-            print("🔄 Streaming response after", time.time() - start_time, "seconds")
-
-            chunk_count = 0
-            for i, chunk in enumerate(response):
-                # Check if client disconnected
-                if client_disconnected:
-                    print("🔌 Client disconnected, stopping stream")
-                    break
-                    
-                chunk_count += 1
-
-                if i == 0:
-                    print("First chunk after:", time.time() - start_time, "seconds")
-
-                if chunk_count % 10 == 0:  # Log cada 10 chunks
-                    print(f"📦 Processed {chunk_count} chunks")
-
-                yield chunk.response.encode("utf-8")
 
-                # Pequeña pausa para permitir verificaciones de desconexión
-                await asyncio.sleep(0.001)
+            TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - received)
+            trace.record("first_chunk", received_ns, time.time_ns())
+            stream_span = trace.child("stream")
 
-            print(
-                f"✅ Streaming completed successfully after {time.time() - start_time} seconds, {chunk_count} chunks"
-            )
+            while item is not None:
+                chunk_count += 1
+                yield item.encode("utf-8")
+                item = await anext(chunks, None)
+
+            if not subscription.left:
+                logger.debug(
+                    "✅ Streaming completed elapsed=%.2fs chunks=%d",
+                    time.perf_counter() - received,
+                    chunk_count,
+                )
 
         except asyncio.CancelledError:
-            print("❌ Streaming cancelled - client likely disconnected")
-            client_disconnected = True
-            # Cancelar la tarea de Ollama si está corriendo
-            if ollama_task and not ollama_task.done():
-                ollama_task.cancel()
+            DISCONNECTS.inc()
+            logger.info("❌ Streaming cancelled - client likely disconnected")
             raise
         except Exception as e:
-            print(f"❌ Exception while streaming: {str(e)}")
+            ERRORS.labels(stage="stream").inc()
+            logger.error("❌ Exception while streaming error=%s", e)
             yield f"[Error: {str(e)}]".encode("utf-8")
         finally:
-            # Cleanup
-            if 'connection_task' in locals():
-                connection_task.cancel()
-            if ollama_task and not ollama_task.done():
-                ollama_task.cancel()
+            watch_task.cancel()
+            if stream_span is not None:
+                stream_span.set(chunks=chunk_count, disconnected=subscription.left)
+                stream_span.end()
+            subscription.leave()
+            STREAM_SECONDS.observe(time.perf_counter() - received)
 
     return StreamingResponse(stream_generator(), media_type="text/plain")
 
 
+@app.on_event("startup")
+async def start_fallback_watcher():
+    app.state.fallback_watcher = asyncio.create_task(meditime_doc.watch())
+    app.state.drug_watcher = asyncio.create_task(drug_matcher.watch())
+    app.state.bm25_watcher = asyncio.create_task(bm25_index.watch(INDEX_VERSION_PATH))
+    app.state.ollama_watcher = asyncio.create_task(
+        backend_pool.watch(OLLAMA_HEALTH_INTERVAL)
+    )
+    app.state.trace_exporter = asyncio.create_task(tracer.watch())
+
+
+@app.on_event("shutdown")
+def shutdown_resources():
+    app.state.fallback_watcher.cancel()
+    app.state.drug_watcher.cancel()
+    app.state.bm25_watcher.cancel()
+    app.state.ollama_watcher.cancel()
+    app.state.trace_exporter.cancel()
+    hybrid_retriever.shutdown()
+    retriever.shutdown()
+    embedding_cache.save()
+
+
 # Agregar manejo de señales para shutdown limpio
 def signal_handler(sig, frame):
-    print("\n🛑 Received shutdown signal, cleaning up...")
+    logger.info("🛑 Received shutdown signal, cleaning up...")
     sys.exit(0)
 
 
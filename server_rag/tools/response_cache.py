@@ -0,0 +1,121 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticResponseCache:
+    """Caché de contextos ya generados, buscada por similitud del prompt.
+
+    Cada partición (idioma y top_k: el contexto depende de los dos) tiene su
+    propio índice de vectores normalizados; una consulta acierta si la distancia coseno al prompt más cercano es <= max_distance.
+    Las entradas caducan por TTL, se expulsan por LRU al pasar de max_size y
+    se invalidan todas cuando index_documents.py vuelve a indexar (cambia el
+    fichero version_path).
+    """
+
+    VERSION_CHECK_INTERVAL = 5.0
+
+    def __init__(self, max_size=512, ttl=3600, max_distance=0.08, version_path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.version_path = version_path
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # (partition, id) -> (vector, context, created)
+        self._matrices = {}  # partition -> (keys, matriz de vectores)
+        self._next_id = 0
+        self._version = self._read_version()
+        self._version_checked = time.monotonic()
+
+    def _read_version(self):
+        try:
+            return os.stat(self.version_path).st_mtime if self.version_path else None
+        except OSError:
+            return None
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._version_checked < self.VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked = now
+        version = self._read_version()
+        if version != self._version:
+            self._version = version
+            self.clear()
+            self.invalidations += 1
+            logger.info("♻️ Index changed, semantic response cache cleared")
+
+    def _matrix(self, partition):
+        if partition not in self._matrices:
+            keys = [key for key in self._entries if key[0] == partition]
+            vectors = (
+                np.stack([self._entries[key][0] for key in keys]) if keys else None
+            )
+            self._matrices[partition] = (keys, vectors)
+        return self._matrices[partition]
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+
+    def lookup(self, embedding, partition):
+        """Contexto cacheado más cercano de ``partition`` o None."""
+        self._check_version()
+        keys, vectors = self._matrix(partition)
+        if vectors is None:
+            self.misses += 1
+            return None
+
+        query = np.array(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        similarities = vectors @ query
+        best = int(np.argmax(similarities))
+        key = keys[best]
+        _, context, created = self._entries[key]
+
+        if time.time() - created > self.ttl:
+            self._remove(key)
+            self.misses += 1
+            return None
+        if 1.0 - float(similarities[best]) > self.max_distance:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return context
+
+    def store(self, embedding, partition, context):
+        if not context.strip():
+            return
+        vector = np.array(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        key = (partition, self._next_id)
+        self._next_id += 1
+        self._entries[key] = (vector, context, time.time())
+        self._matrices.pop(partition, None)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._matrices.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
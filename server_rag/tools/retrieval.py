@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from metrics import CHROMA_SECONDS, ERRORS, TIMEOUTS
+from tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+
+class BatchedRetriever:
+    """Etapa de retrieval asíncrona para /context.
+
+    Los prompts que llegan dentro de una ventana corta se agrupan en una sola
+    llamada batch al modelo de embeddings y una sola consulta multi-query a
+    Chroma, ejecutadas en un pool de hilos propio (nunca en el event loop).
+    Mientras todos los workers están ocupados los prompts siguen acumulándose,
+    así que con más carga los batches crecen solos.
+    """
+
+    def __init__(self, embed_model, collection, window_ms=5, max_batch=32, workers=2):
+        self.embed_model = embed_model
+        self.collection = collection
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="retrieval"
+        )
+        self._pending = []
+        self._busy = 0
+        self._flush_handle = None
+
+    async def embed(self, prompt: str):
+        """Solo el embedding del prompt, agrupado con el resto del batch."""
+        return await self._submit(prompt, None, None, None)
+
+    async def retrieve(self, prompt: str, top_k: int, embedding=None, where=None):
+        """Nodos más cercanos; si ya se tiene el embedding solo se consulta Chroma.
+
+        ``where`` es un filtro de metadatos de Chroma (p. ej. por sección).
+        """
+        return await self._submit(prompt, top_k, embedding, where)
+
+    async def fetch_drugs(
+        self, drug_keys, embedding, top_k, section=None, max_distance=None
+    ):
+        """Secciones de medicamentos concretos leídas por metadatos, sin
+        búsqueda vectorial; se ordenan por distancia al embedding del prompt
+        y se descartan las que quedan a más de ``max_distance``."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self._fetch_drugs,
+            drug_keys,
+            embedding,
+            top_k,
+            section,
+            max_distance,
+        )
+
+    def _fetch_drugs(self, drug_keys, embedding, top_k, section, max_distance):
+        where = {"drug_key": {"$in": list(drug_keys)}}
+        if section:
+            where = {"$and": [where, {"section": section}]}
+        with CHROMA_SECONDS.labels(operation="get").time():
+            result = self.collection.get(
+                where=where, include=["documents", "metadatas", "embeddings"]
+            )
+        if not result["ids"]:
+            return []
+
+        # Distancia L2 al cuadrado, la misma que usa la colección en query()
+        vectors = np.asarray(result["embeddings"], dtype=np.float32)
+        distances = ((vectors - np.asarray(embedding, dtype=np.float32)) ** 2).sum(axis=1)
+        best = np.argsort(distances)[:top_k]
+        if max_distance:
+            best = best[distances[best] <= max_distance]
+        return [
+            NodeWithScore(
+                node=metadata_dict_to_node(
+                    result["metadatas"][i], text=result["documents"][i]
+                ),
+                score=math.exp(-float(distances[i])),
+            )
+            for i in best
+        ]
+
+    async def _submit(self, prompt, top_k, embedding, where):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Peticiones trazadas: span y momento de entrada para medir la espera
+        span = current_span()
+        trace = (span, time.time_ns()) if span.sampled else None
+        self._pending.append((prompt, top_k, embedding, where, trace, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending or self._busy >= self.workers:
+            return
+
+        batch = self._pending[: self.max_batch]
+        self._pending = self._pending[self.max_batch :]
+        self._busy += 1
+
+        items = [item[:4] for item in batch]
+        loop = asyncio.get_running_loop()
+        dispatched = time.time_ns()
+        task = loop.run_in_executor(self._executor, self._retrieve_batch, items)
+        task.add_done_callback(lambda done: self._resolve(batch, done, dispatched))
+
+    def _resolve(self, batch, done, dispatched):
+        self._busy -= 1
+        error = done.exception()
+        finished = time.time_ns()
+        for i, (*_, trace, future) in enumerate(batch):
+            if trace is not None:
+                span, submitted = trace
+                span.record("retrieval.queue_wait", submitted, dispatched)
+                span.record(
+                    "retrieval.batch", dispatched, finished, batch_size=len(batch)
+                )
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(done.result()[i])
+
+        # Lo acumulado mientras los workers estaban ocupados sale sin esperar
+        if self._pending:
+            self._flush()
+
+    def _retrieve_batch(self, items):
+        embeddings = [item[2] for item in items]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            # all-MiniLM-L6-v2 no usa instrucción de query, así que los
+            # embeddings de texto y de consulta son los mismos.
+            vectors = self.embed_model.get_text_embedding_batch(
+                [items[i][0] for i in missing]
+            )
+            for i, vector in zip(missing, vectors):
+                embeddings[i] = vector
+
+        # Las peticiones de solo-embedding devuelven el vector; las demás se
+        # agrupan por filtro: una consulta multi-query a Chroma por filtro.
+        results = list(embeddings)
+        groups = {}
+        for i, (_, top_k, _, where) in enumerate(items):
+            if top_k:
+                key = json.dumps(where, sort_keys=True)
+                groups.setdefault(key, (where, []))[1].append(i)
+
+        for where, queries in groups.values():
+            with CHROMA_SECONDS.labels(operation="query").time():
+                result = self.collection.query(
+                    query_embeddings=[embeddings[i] for i in queries],
+                    n_results=max(items[i][1] for i in queries),
+                    where=where,
+                    include=["documents", "metadatas", "distances"],
+                )
+            for i, documents, metadatas, distances in zip(
+                queries, result["documents"], result["metadatas"], result["distances"]
+            ):
+                results[i] = [
+                    # Misma puntuación que ChromaVectorStore.query
+                    NodeWithScore(
+                        node=metadata_dict_to_node(metadata, text=document),
+                        score=math.exp(-distance),
+                    )
+                    for document, metadata, distance in zip(
+                        documents, metadatas, distances
+                    )
+                ][: items[i][1]]
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HybridRetriever:
+    """BM25 + vectorial en paralelo, fusionados con reciprocal rank fusion.
+
+    Cada etapa tiene su presupuesto de latencia: si una no termina a tiempo
+    se usa solo el resultado de la otra (y se cuenta en ``stats``). El BM25
+    devuelve ids; el texto y los metadatos se leen de Chroma con ``get``,
+    que también aplica el filtro ``where``. Como el BM25 no conoce los
+    metadatos, con filtro se piden hasta ``filtered_candidates`` ids y se
+    leen por tandas crecientes hasta tener suficientes que lo cumplan.
+    """
+
+    def __init__(
+        self,
+        vector,
+        bm25,
+        candidates=10,
+        rrf_k=60,
+        vector_budget_ms=300,
+        bm25_budget_ms=150,
+        filtered_candidates=1000,
+    ):
+        self.vector = vector
+        self.bm25 = bm25
+        self.candidates = candidates
+        self.filtered_candidates = filtered_candidates
+        self.rrf_k = rrf_k
+        self.vector_budget = vector_budget_ms / 1000
+        self.bm25_budget = bm25_budget_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25")
+        self.timeouts = {"vector": 0, "bm25": 0}
+
+    async def retrieve(self, prompt: str, top_k: int, embedding=None, where=None):
+        fetch_k = max(top_k, self.candidates)
+        loop = asyncio.get_running_loop()
+        stages = {
+            "vector": asyncio.wait_for(
+                self.vector.retrieve(prompt, top_k=fetch_k, embedding=embedding, where=where),
+                self.vector_budget,
+            ),
+            "bm25": asyncio.wait_for(
+                loop.run_in_executor(self._executor, self._lexical, prompt, fetch_k, where),
+                self.bm25_budget,
+            ),
+        }
+        results = await asyncio.gather(*stages.values(), return_exceptions=True)
+
+        rankings = []
+        for name, result in zip(stages, results):
+            if isinstance(result, asyncio.TimeoutError):
+                self.timeouts[name] += 1
+                TIMEOUTS.labels(stage=name).inc()
+                logger.warning("⏱️ Retrieval stage over budget, skipped stage=%s", name)
+            elif isinstance(result, BaseException):
+                ERRORS.labels(stage=name).inc()
+                logger.error("❌ Retrieval stage failed stage=%s error=%s", name, result)
+            else:
+                rankings.append(result)
+        if not rankings:
+            raise RuntimeError("Both retrieval stages failed")
+        return self._fuse(rankings, top_k)
+
+    def _lexical(self, prompt, fetch_k, where):
+        if where is None:
+            return self._load(self.bm25.search(prompt, fetch_k), where)
+
+        # El top fetch_k global puede no tener ningún nodo que cumpla el
+        # filtro: se recorre el ranking en tandas x4 hasta llenar fetch_k.
+        hits = self.bm25.search(prompt, max(fetch_k, self.filtered_candidates))
+        nodes, start, window = [], 0, fetch_k
+        while start < len(hits) and len(nodes) < fetch_k:
+            window *= 4
+            nodes += self._load(hits[start : start + window], where)
+            start += window
+        return nodes[:fetch_k]
+
+    def _load(self, hits, where):
+        """Nodos de los hits del BM25 que cumplen ``where``, en el mismo orden."""
+        if not hits:
+            return []
+        with CHROMA_SECONDS.labels(operation="get").time():
+            result = self.vector.collection.get(
+                ids=[node_id for node_id, _ in hits],
+                where=where,
+                include=["documents", "metadatas"],
+            )
+        found = {
+            node_id: (document, metadata)
+            for node_id, document, metadata in zip(
+                result["ids"], result["documents"], result["metadatas"]
+            )
+        }
+        nodes = []
+        for node_id, score in hits:
+            if node_id in found:
+                document, metadata = found[node_id]
+                node = metadata_dict_to_node(metadata, text=document)
+                nodes.append(NodeWithScore(node=node, score=score))
+        return nodes
+
+    def _fuse(self, rankings, top_k):
+        scores, nodes = {}, {}
+        for ranking in rankings:
+            for rank, node in enumerate(ranking):
+                node_id = node.node.node_id
+                nodes.setdefault(node_id, node.node)
+                scores[node_id] = scores.get(node_id, 0.0) + 1 / (self.rrf_k + rank + 1)
+        best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        return [NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in best]
+
+    def stats(self):
+        return {**self.bm25.stats(), "timeouts": dict(self.timeouts)}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,95 @@
+import re
+
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import TextNode
+
+from medication_store import LABEL_SECTIONS, normalize_name
+
+# Encabezados "##" del markdown de get_medications.py -> columna de labels
+MARKDOWN_SECTIONS = {
+    "Manufacturer": "manufacturer",
+    "Active Ingredient": "active_ingredient",
+    "Purpose": "purpose",
+    "Description": "description",
+    "Indications": "indications",
+    "Warnings": "warnings",
+    "Do Not Use": "contraindications",
+    "When Using": "when_using",
+    "Stop Use": "stop_use",
+    "Keep Out of Reach of Children": "keep_out",
+    "Side Effects": "side_effects",
+    "Dosage Recommendations": "dosage",
+    "Storage and Handling": "storage",
+    "Inactive Ingredients": "inactive_ingredients",
+    "Questions or Comments": "questions",
+}
+SECTION_TITLES = {key: title for title, key in MARKDOWN_SECTIONS.items()}
+MEDICATION_HEADER = "# Name of the Medicine"
+_EMPTY = {"", "-", "- ", "Not available.", "- Not available.", "Not specified"}
+_HEADING = re.compile(r"(?m)^## (.+)$")
+
+
+class MedicationSectionParser:
+    """Un nodo por (medicamento, sección) con metadatos name/section/manufacturer.
+
+    Cada nodo empieza por "<nombre> - <sección>:" para que su embedding sepa
+    de qué medicamento habla; las secciones muy largas se parten con el
+    SentenceSplitter conservando los metadatos.
+    """
+
+    def __init__(self, chunk_size=512, chunk_overlap=32):
+        self.splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    def nodes_from_sections(self, name, manufacturer, sections, extra_metadata=None):
+        nodes = []
+        for section, text in sections:
+            text = text.strip()
+            if text in _EMPTY:
+                continue
+            metadata = {
+                "name": name,
+                "drug_key": normalize_name(name),
+                "section": section,
+                "manufacturer": manufacturer,
+                **(extra_metadata or {}),
+            }
+            prefix = f"{name} - {SECTION_TITLES.get(section, section)}:"
+            for chunk in self.splitter.split_text(text):
+                nodes.append(TextNode(text=f"{prefix}\n{chunk}", metadata=metadata))
+        return nodes
+
+    def from_label_row(self, row):
+        """Fila de la tabla labels (solo columnas no nulas)."""
+        sections = [(s, row[s]) for s in LABEL_SECTIONS if s in row]
+        return self.nodes_from_sections(
+            row["name"],
+            row.get("manufacturer", ""),
+            sections,
+            {"set_id": row.get("set_id", "")},
+        )
+
+    @staticmethod
+    def is_medication_markdown(text):
+        return text.lstrip().startswith(MEDICATION_HEADER)
+
+    def from_markdown(self, text, extra_metadata=None):
+        """Markdown generado por format_markdown / write_from_json."""
+        parts = _HEADING.split(text)
+        # parts = [cabecera con el nombre, título, cuerpo, título, cuerpo, ...]
+        name_lines = [
+            line.strip()
+            for line in parts[0].replace(MEDICATION_HEADER, "").splitlines()
+            if line.strip()
+        ]
+        # write_from_json escribe "en: nombre" / "es: ..." / "fr: ..."
+        name = name_lines[0].removeprefix("en:").strip() if name_lines else "Unknown"
+
+        sections = []
+        manufacturer = ""
+        for title, body in zip(parts[1::2], parts[2::2]):
+            section = MARKDOWN_SECTIONS.get(title.strip(), title.strip().lower())
+            if section == "manufacturer":
+                manufacturer = body.strip()
+                continue
+            sections.append((section, body.lstrip("- ").strip()))
+        return self.nodes_from_sections(name, manufacturer, sections, extra_metadata)
@@ -0,0 +1,144 @@
+import asyncio
+
+
+class Flight:
+    """Una generación de /context compartida por varias peticiones iguales.
+
+    Guarda todos los chunks publicados para que quien se une tarde reciba
+    primero lo ya generado y después lo nuevo. ``ready`` se resuelve cuando
+    la generación arranca (o falla antes de arrancar, p. ej. por admisión).
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.ready = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self):
+        if not self.ready.done():
+            self.ready.set_result(None)
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def finish(self, error=None):
+        if self.finished:
+            return
+        self.finished = True
+        self.error = error
+        if not self.ready.done():
+            if error is None:
+                self.ready.set_result(None)
+            else:
+                self.ready.set_exception(error)
+                self.ready.exception()  # Evita el aviso si nadie la espera
+        self._wake()
+
+
+class Subscription:
+    """Lectura de un Flight por una petición: repite el prefijo y sigue en vivo."""
+
+    def __init__(self, flights, flight, leader):
+        self.flight = flight
+        self.leader = leader
+        self.left = False
+        self._flights = flights
+
+    async def wait_ready(self):
+        await asyncio.shield(self.flight.ready)
+
+    def leave(self):
+        """Idempotente. Si era la última suscripción se cancela la generación."""
+        if self.left:
+            return
+        self.left = True
+        self._flights._leave(self.flight)
+        self.flight._wake()
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        position = 0
+        flight = self.flight
+        while not self.left:
+            changed = flight._changed
+            if position < len(flight.chunks):
+                chunks = flight.chunks[position:]
+                position += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                continue
+            if flight.finished:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    """Agrupa las peticiones idénticas que llegan mientras otra está en curso.
+
+    ``join(key, run)`` devuelve una suscripción al Flight de ``key``; si no
+    existe lo crea y lanza ``run(flight)`` como tarea. La tarea se cancela
+    cuando se va el último suscriptor, y el Flight se olvida al acabar: las
+    repeticiones posteriores las cubre la caché semántica.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.started = 0
+        self.joined = 0
+        self.cancelled = 0
+
+    def join(self, key, run):
+        flight = self.flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = Flight(key)
+            self.flights[key] = flight
+            flight.task = asyncio.create_task(run(flight))
+            flight.task.add_done_callback(lambda task: self._done(flight, task))
+            self.started += 1
+        else:
+            self.joined += 1
+        flight.subscribers += 1
+        return Subscription(self, flight, leader)
+
+    def _leave(self, flight):
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.task.done():
+            self.cancelled += 1
+            self._forget(flight)
+            flight.task.cancel()
+
+    def _forget(self, flight):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def _done(self, flight, task):
+        self._forget(flight)
+        if task.cancelled():
+            flight.finish(RuntimeError("Generation cancelled"))
+        elif task.exception() is not None:
+            flight.finish(task.exception())
+        else:
+            flight.finish()
+
+    def stats(self):
+        return {
+            "in_flight": len(self.flights),
+            "started": self.started,
+            "joined": self.joined,
+            "cancelled": self.cancelled,
+        }
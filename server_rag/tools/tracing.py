@@ -0,0 +1,336 @@
+"""Trazas por petición compatibles con OpenTelemetry (sin el SDK).
+
+Cada petición muestreada tiene un span raíz y spans hijos por etapa. El
+span actual viaja en un ContextVar, así que las tareas creadas durante la
+petición (p. ej. la generación compartida) cuelgan de él. El contexto llega
+del cliente con la cabecera W3C ``traceparent``.
+
+Las peticiones no muestreadas usan ``NOOP_SPAN``: no se crea ningún objeto
+ni se lee el reloj. Los spans terminados se exportan por lotes desde
+``Tracer.watch``, fuera del camino de la petición, a un sink: fichero JSON
+(una línea por span) u OTLP/HTTP JSON hacia un collector local.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+# Valores de SpanKind y StatusCode de OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+STATUS_ERROR = 2
+
+
+def parse_traceparent(header):
+    """(trace_id, span_id, sampled) de una cabecera traceparent, o None."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if not match:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def _new_id(n_bytes):
+    return f"{random.getrandbits(n_bytes * 8):0{n_bytes * 2}x}"
+
+
+class _NoopSpan:
+    """Span de una petición no muestreada: todas las operaciones son gratis."""
+
+    sampled = False
+    trace_id = None
+
+    def child(self, name, **attributes):
+        return self
+
+    def record(self, name, start_ns, end_ns, **attributes):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span = ContextVar("current_span", default=NOOP_SPAN)
+
+
+class Span:
+    sampled = True
+
+    def __init__(
+        self,
+        tracer,
+        name,
+        trace_id,
+        parent_id=None,
+        kind=KIND_INTERNAL,
+        start_ns=None,
+        attributes=None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def child(self, name, **attributes):
+        return Span(self.tracer, name, self.trace_id, self.span_id, attributes=attributes)
+
+    def record(self, name, start_ns, end_ns, **attributes):
+        """Span hijo ya terminado, medido por quien lo llama."""
+        span = Span(
+            self.tracer,
+            name,
+            self.trace_id,
+            self.span_id,
+            start_ns=start_ns,
+            attributes=attributes,
+        )
+        span.end_ns = end_ns
+        self.tracer._finish(span)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+        self.tracer._finish(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Span hijo del actual mientras dura el bloque (y actual dentro de él)."""
+    parent = _current_span.get()
+    if not parent.sampled:
+        yield parent
+        return
+    child = parent.child(name, **attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+@contextmanager
+def use_span(current):
+    """Hace de ``current`` el span actual durante el bloque, sin terminarlo."""
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+
+
+class JsonFileSink:
+    """Una línea JSON por span (formato de span de OTLP)."""
+
+    def __init__(self, path, service_name):
+        self.path = path
+        self.service_name = service_name
+
+    async def export(self, spans):
+        lines = "".join(
+            json.dumps({"service": self.service_name, **span.to_otlp()}) + "\n"
+            for span in spans
+        )
+        await asyncio.to_thread(self._append, lines)
+
+    def _append(self, lines):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def close(self):
+        pass
+
+
+class OtlpHttpSink:
+    """OTLP/HTTP con codificación JSON (p. ej. http://127.0.0.1:4318/v1/traces)."""
+
+    def __init__(self, endpoint, service_name, timeout=5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.client = httpx.AsyncClient(timeout=timeout)
+
+    async def export(self, spans):
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_otlp_attribute("service.name", self.service_name)]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "rag_api.tracing"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        response = await self.client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_sink(exporter, json_path, otlp_endpoint, service_name):
+    """Sink para RAG_TRACE_EXPORTER: "json", "otlp" o "none" (None)."""
+    if exporter == "json":
+        return JsonFileSink(json_path, service_name)
+    if exporter == "otlp":
+        return OtlpHttpSink(otlp_endpoint, service_name)
+    if exporter not in ("", "none"):
+        raise ValueError(f"Unknown trace exporter: {exporter}")
+    return None
+
+
+class Tracer:
+    """Decide el muestreo de cada petición y exporta los spans terminados.
+
+    Si el cliente manda un ``traceparent`` muestreado se respeta; si no, se
+    muestrea con probabilidad ``sample_rate`` (conservando su trace id). Sin
+    sink no se muestrea nada. Si el sink no da abasto se descartan los spans
+    más antiguos (``max_pending``).
+    """
+
+    def __init__(self, sink=None, sample_rate=0.0, max_pending=4096, batch_size=512):
+        self.sink = sink
+        self.sample_rate = sample_rate if sink is not None else 0.0
+        self.batch_size = batch_size
+        self._pending = deque(maxlen=max_pending)
+        self.started = 0
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    def start(self, name, traceparent=None, **attributes):
+        """Span raíz de una petición (NOOP_SPAN si no se muestrea)."""
+        if self.sink is None:
+            return NOOP_SPAN
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id, sampled = None, None, False
+        if not sampled and (not self.sample_rate or random.random() >= self.sample_rate):
+            return NOOP_SPAN
+        self.started += 1
+        return Span(
+            self,
+            name,
+            trace_id or _new_id(16),
+            parent_id,
+            kind=KIND_SERVER,
+            attributes=attributes,
+        )
+
+    def _finish(self, span):
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append(span)
+
+    async def flush(self):
+        while self._pending:
+            batch = [
+                self._pending.popleft()
+                for _ in range(min(self.batch_size, len(self._pending)))
+            ]
+            try:
+                await self.sink.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.export_errors += 1
+                self.dropped += len(batch)
+                logger.warning("⚠️ Trace export failed spans=%d error=%s", len(batch), e)
+                return
+
+    async def watch(self, interval=2.0):
+        """Exporta periódicamente los spans terminados."""
+        if self.sink is None:
+            return
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+            await self.sink.close()
+
+    def stats(self):
+        return {
+            "exporter": type(self.sink).__name__ if self.sink else None,
+            "sample_rate": self.sample_rate,
+            "traces_started": self.started,
+            "spans_exported": self.exported,
+            "spans_pending": len(self._pending),
+            "spans_dropped": self.dropped,
+            "export_errors": self.export_errors,
+        }